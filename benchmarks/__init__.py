@@ -0,0 +1,4 @@
+#Benchmarks and load-test harnesses for the site
+#Run them from the repo root as modules, e.g.
+#   python -m benchmarks.booking_load
+#Each one builds its own throwaway database so they never touch sitedata.sqlite.
@@ -0,0 +1,91 @@
+#Concurrent booking load test
+#
+#Fires a pile of bookings at ONE event from lots of threads at once (a flash
+#sale basically) and checks that we never sell more tickets than the capacity.
+#
+#   python -m benchmarks.booking_load --attempts 5000 --threads 64 --capacity 1000
+#
+#Exits with status 1 if the event got oversold or the counter doesn't match
+#the bookings table.
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent booking load test")
+    parser.add_argument('--attempts', type=int, default=2000, help="total booking attempts")
+    parser.add_argument('--threads', type=int, default=32, help="concurrent worker threads")
+    parser.add_argument('--capacity', type=int, default=500, help="event capacity")
+    parser.add_argument('--max-qty', type=int, default=3, help="tickets per booking (1..max)")
+    parser.add_argument('--database-uri', default=None, help="defaults to a temp sqlite file")
+    args = parser.parse_args(argv)
+
+    if args.database_uri is None:
+        tmp = tempfile.mkdtemp(prefix='booking_load_')
+        args.database_uri = 'sqlite:///' + os.path.join(tmp, 'load.sqlite')
+    os.environ['DATABASE_URI'] = args.database_uri
+    os.environ.setdefault('FLASK_DEBUG', '0')
+
+    from website import create_app, db
+    from website.models import User, Event, Booking
+    from website.booking import reserve_seats, BookingError
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        host = User(name='host', email='host@example.com', password='x')
+        db.session.add(host)
+        db.session.commit()
+        event = Event(title='Flash sale', location='Pool', capacity=args.capacity, cost=10.0,
+                      status='Open', created_by=host.id, date=datetime.now() + timedelta(days=7))
+        db.session.add(event)
+        db.session.commit()
+        event_id, user_id = event.id, host.id
+
+    results = {'ok': 0, 'rejected': 0, 'busy': 0, 'tickets': 0}
+
+    def attempt(i):
+        qty = 1 + i % args.max_qty
+        with app.app_context():
+            try:
+                reserve_seats(event_id, user_id, qty, 10.0)
+                return 'ok', qty
+            except BookingError as e:
+                return ('busy' if 'busy' in str(e) else 'rejected'), 0
+            finally:
+                db.session.remove()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        for outcome, qty in pool.map(attempt, range(args.attempts)):
+            results[outcome] += 1
+            results['tickets'] += qty
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        sold = db.session.get(Event, event_id).tickets_sold
+        booked = db.session.scalar(
+            db.select(db.func.coalesce(db.func.sum(Booking.quantity), 0)).where(Booking.event_id == event_id)
+        )
+
+    print(f"attempts:       {args.attempts} ({args.threads} threads)")
+    print(f"successful:     {results['ok']}  rejected: {results['rejected']}  gave up (busy): {results['busy']}")
+    print(f"tickets sold:   {sold} / {args.capacity} (bookings table says {booked})")
+    print(f"elapsed:        {elapsed:.2f}s")
+    print(f"throughput:     {args.attempts / elapsed:.1f} attempts/sec, {results['ok'] / elapsed:.1f} bookings/sec")
+
+    if sold > args.capacity or sold != booked or booked != results['tickets']:
+        print("FAIL: capacity exceeded or counters out of sync")
+        return 1
+    print("OK: capacity never exceeded")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
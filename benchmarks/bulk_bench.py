@@ -0,0 +1,175 @@
+#Bulk import/export check
+#
+#Writes a file of --rows bookings (default a million) for some generated users and
+#events, imports everything with the same code `flask import-data` uses, exports the
+#bookings back out like `flask export-data`, then checks:
+#   - every row made it in and back out, and tickets_sold matches the bookings
+#   - import and export each ran at least --min-import-rate / --min-export-rate rows/s
+#   - peak memory grew by less than --max-memory-mb while doing it
+#     (anonymous RSS, sampled: sqlite's mmap'd db file pages would show up in plain
+#     RSS and grow with the file even though nothing is held in python)
+#Exits with status 1 if any of those fail.
+#
+#   python -m benchmarks.bulk_bench
+#   python -m benchmarks.bulk_bench --rows 100000 --format csv --batch-size 10000
+
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def _anon_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # not linux, peak RSS
+
+
+#runs fn() and returns (result, seconds, MB memory grew by at its peak)
+def _measure(fn):
+    base = _anon_mb()
+    peak = [base]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            peak[0] = max(peak[0], _anon_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return result, seconds, max(peak[0], _anon_mb()) - base
+
+
+def _write_file(path, fmt, records, fields):
+    with open(path, 'w', encoding='utf-8', newline='') as out:
+        if fmt == 'csv':
+            out.write(','.join(fields) + '\n')
+            for r in records:
+                out.write(','.join('' if r[f] is None else str(r[f]) for f in fields) + '\n')
+        else:
+            for r in records:
+                out.write(json.dumps(r) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and export a lot of bookings")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson')
+    parser.add_argument('--batch-size', type=int, default=None, help="BULK_BATCH_SIZE")
+    parser.add_argument('--min-import-rate', type=float, default=15000)
+    parser.add_argument('--min-export-rate', type=float, default=50000)
+    parser.add_argument('--max-memory-mb', type=float, default=50)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='bulk_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    if args.batch_size:
+        os.environ['BULK_BATCH_SIZE'] = str(args.batch_size)
+
+    from website import create_app, db, passwords
+    from website.bulk import import_stream, export_chunks, export_rows
+    from website.models import Event
+
+    app = create_app()
+    rng = random.Random(1)
+    now = datetime.utcnow().replace(microsecond=0)
+    ext = args.format
+    users_file = os.path.join(tmp, f'users.{ext}')
+    events_file = os.path.join(tmp, f'events.{ext}')
+    bookings_file = os.path.join(tmp, f'bookings.{ext}')
+    export_file = os.path.join(tmp, f'export.{ext}')
+
+    with app.app_context():
+        db.create_all()
+        password = passwords.hash_password('bench')
+
+    #input files, written as generators so the script itself stays small too
+    _write_file(users_file, ext, ({'id': i, 'name': f'user{i}', 'email': f'user{i}@example.com',
+                                   'password_hash': password} for i in range(1, args.users + 1)),
+                ('id', 'name', 'email', 'password_hash'))
+    _write_file(events_file, ext, ({'id': i, 'title': f'Pool party {i}', 'location': 'Brisbane',
+                                    'capacity': 1_000_000, 'cost': 5.0, 'status': 'Open',
+                                    'created_by': rng.randint(1, args.users),
+                                    'date': (now + timedelta(days=i % 365 + 1)).isoformat()}
+                                   for i in range(1, args.events + 1)),
+                ('id', 'title', 'location', 'capacity', 'cost', 'status', 'created_by', 'date'))
+    expected_tickets = 0
+
+    def bookings():
+        nonlocal expected_tickets
+        for i in range(1, args.rows + 1):
+            quantity = rng.randint(1, 4)
+            expected_tickets += quantity
+            yield {'id': i, 'user_id': rng.randint(1, args.users), 'event_id': rng.randint(1, args.events),
+                   'quantity': quantity, 'price': 5.0 * quantity,
+                   'date': (now - timedelta(seconds=i)).isoformat()}
+
+    _write_file(bookings_file, ext, bookings(), ('id', 'user_id', 'event_id', 'quantity', 'price', 'date'))
+    size_mb = os.path.getsize(bookings_file) / 1024 ** 2
+
+    failures = []
+    with app.app_context():
+        for kind, path in (('users', users_file), ('events', events_file)):
+            with open(path, encoding='utf-8', newline='') as f:
+                import_stream(kind, f, ext)
+
+        def run_import():
+            with open(bookings_file, encoding='utf-8', newline='') as f:
+                return import_stream('bookings', f, ext)
+
+        def run_export():
+            with open(export_file, 'w', encoding='utf-8', newline='') as out:
+                for chunk in export_chunks('bookings', ext):
+                    out.write(chunk)
+
+        imported, import_secs, import_mb = _measure(run_import)
+        _, export_secs, export_mb = _measure(run_export)
+
+        tickets = db.session.scalar(db.select(db.func.sum(Event.tickets_sold)))
+        with open(export_file, encoding='utf-8') as f:
+            exported = sum(1 for _ in f) - (1 if ext == 'csv' else 0)
+        first = next(export_rows('bookings'), None)
+
+    import_rate = imported / import_secs
+    export_rate = exported / export_secs
+    print(f"bookings file:   {args.rows} rows, {size_mb:.0f} MB {ext}")
+    print(f"import:          {imported} rows in {import_secs:.1f}s = {import_rate:,.0f} rows/s, memory +{import_mb:.1f} MB")
+    print(f"export:          {exported} rows in {export_secs:.1f}s = {export_rate:,.0f} rows/s, memory +{export_mb:.1f} MB")
+    print(f"tickets_sold:    {tickets} (expected {expected_tickets})")
+
+    if imported != args.rows or exported != args.rows:
+        failures.append("row counts don't match")
+    if tickets != expected_tickets or first is None or first['id'] != 1:
+        failures.append("imported data doesn't match the file")
+    if import_rate < args.min_import_rate:
+        failures.append(f"import slower than {args.min_import_rate:,.0f} rows/s")
+    if export_rate < args.min_export_rate:
+        failures.append(f"export slower than {args.min_export_rate:,.0f} rows/s")
+    if max(import_mb, export_mb) > args.max_memory_mb:
+        failures.append(f"memory grew more than {args.max_memory_mb:.0f} MB")
+    for failure in failures:
+        print("FAILED:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#Live tickets fan-out check
+#
+#Starts the app on a real threaded server, opens --clients Server-Sent Events streams
+#on one event (what view_event does in the browser), then:
+#   1. books tickets through the app, every stream should get the new tickets_left
+#      right away (the booking pokes this worker's broadcaster)
+#   2. changes the row straight in the database, like another worker would, every
+#      stream should get that within LIVE_POLL_SECONDS
+#and reports how long the slowest client took plus how many queries the broadcaster
+#ran for it (should be about one per change, not one per client).
+#Exits with status 1 if a client missed an update.
+#
+#   python -m benchmarks.live_bench --clients 500
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fan-out of live ticket updates to many SSE clients")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--poll', type=float, default=1.0, help="LIVE_POLL_SECONDS")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='live_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+    os.environ['LIVE_POLL_SECONDS'] = str(args.poll)
+    os.environ.setdefault('LIVE_MAX_CONNECTIONS', str(args.clients + 10))
+    os.environ.setdefault('ADMISSION_ENABLED', '0')
+
+    from werkzeug.serving import make_server
+    from website import create_app, db, live, passwords
+    from website.models import User, Event
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        password = passwords.hash_password('pw')
+        host = User(name='host', email='host@example.com', password=password)
+        buyer = User(name='buyer', email='buyer@example.com', password=password)
+        db.session.add_all([host, buyer])
+        db.session.commit()
+        event = Event(title='Nearly sold out', location='Pool', capacity=1000, cost=5.0, status='Open',
+                      created_by=host.id, date=datetime.now() + timedelta(days=7))
+        db.session.add(event)
+        db.session.commit()
+        event_id = event.id
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    #every client records (time received, tickets_left) for each message
+    received = [[] for _ in range(args.clients)]
+    connected = threading.Semaphore(0)
+
+    def client(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        conn.request('GET', f'/{event_id}/live')
+        response = conn.getresponse()
+        first = True
+        while True:
+            line = response.readline()
+            if not line:
+                return
+            if line.startswith(b'data: '):
+                received[i].append((time.perf_counter(), json.loads(line[6:])['tickets_left']))
+                if first:
+                    connected.release()
+                    first = False
+
+    for i in range(args.clients):
+        threading.Thread(target=client, args=(i,), daemon=True).start()
+    start = time.perf_counter()
+    for _ in range(args.clients):
+        connected.acquire()
+    print(f"clients connected:        {args.clients} in {time.perf_counter() - start:.1f}s")
+
+    def wait_for(tickets_left, since, timeout):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            times = [next((t for t, left in msgs if left == tickets_left and t >= since), None) for msgs in received]
+            if all(t is not None for t in times):
+                return max(times) - since, 0
+            time.sleep(0.01)
+        return None, sum(1 for msgs in received if not any(left == tickets_left and t >= since for t, left in msgs))
+
+    missed = 0
+    booker = app.test_client()
+    booker.post('/login', data={'user_name': 'buyer', 'password': 'pw'})
+    with app.app_context():
+        checks = live.stats()['db_checks']
+        sent = time.perf_counter()
+        booker.post(f'/{event_id}/book', data={'quantity': 3})
+        slowest, lost = wait_for(997, sent, 10)
+        missed += lost
+        print(f"booking in this worker:   all clients updated in {slowest * 1000:.0f} ms" if slowest is not None
+              else f"booking in this worker:   {lost} client(s) missed it")
+        print(f"broadcaster queries:      {live.stats()['db_checks'] - checks}")
+
+        checks = live.stats()['db_checks']
+        sent = time.perf_counter()
+        db.session.execute(db.update(Event).where(Event.id == event_id).values(tickets_sold=Event.tickets_sold + 2))
+        db.session.commit()
+        slowest, lost = wait_for(995, sent, args.poll * 3 + 5)
+        missed += lost
+        print(f"change by another worker: all clients updated in {slowest * 1000:.0f} ms" if slowest is not None
+              else f"change by another worker: {lost} client(s) missed it")
+        print(f"broadcaster queries:      {live.stats()['db_checks'] - checks}")
+        print(f"open streams:             {live.stats()['connections']}")
+    server.shutdown()
+    return 1 if missed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#Login throughput benchmark
+#
+#Runs the app on a real threaded WSGI server and fires concurrent logins at /login
+#for each bcrypt cost, reporting logins/sec, latency and how many requests were shed
+#with a 503 because the hashing pool was full. While the logins run, another thread
+#keeps hitting /list so we can see whether the rest of the site stays responsive.
+#
+#   python -m benchmarks.login_bench --costs 4 8 10 12 --logins 200 --concurrency 32
+#   python -m benchmarks.login_bench --workers 4 --queue-limit 16
+
+import argparse
+import http.client
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+
+def _run_cost(cost, args):
+    tmp = tempfile.mkdtemp(prefix='login_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(cost)
+    if args.workers:
+        os.environ['PASSWORD_WORKERS'] = str(args.workers)
+    if args.queue_limit:
+        os.environ['PASSWORD_QUEUE_LIMIT'] = str(args.queue_limit)
+
+    from werkzeug.serving import make_server
+    from website import create_app, db, passwords
+    from website.models import User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(name='bench', email='bench@example.com', password=passwords.hash_password('bench')))
+        db.session.commit()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  #no per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    body = urlencode({'user_name': 'bench', 'password': 'bench'})
+
+    def login(_):
+        c = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        start = time.perf_counter()
+        c.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+        r = c.getresponse()
+        r.read()
+        return r.status, time.perf_counter() - start
+
+    #other traffic while the logins are running
+    stop = threading.Event()
+    page_times = []
+
+    def browse():
+        c = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        while not stop.is_set():
+            start = time.perf_counter()
+            c.request('GET', '/list')
+            c.getresponse().read()
+            page_times.append(time.perf_counter() - start)
+
+    browser = threading.Thread(target=browse, daemon=True)
+    browser.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    browser.join()
+    server.shutdown()
+
+    ok = [t for status, t in results if status == 302]
+    shed = sum(1 for status, _ in results if status == 503)
+    return {
+        'cost': cost,
+        'ok': len(ok),
+        'shed': shed,
+        'other': len(results) - len(ok) - shed,
+        'logins_per_sec': len(ok) / elapsed,
+        'p50_ms': statistics.median(ok) * 1000 if ok else 0.0,
+        'max_ms': max(ok) * 1000 if ok else 0.0,
+        'list_p50_ms': statistics.median(page_times) * 1000 if page_times else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Login throughput at different bcrypt costs")
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None, help="PASSWORD_WORKERS (default: cpu count)")
+    parser.add_argument('--queue-limit', type=int, default=None, help="PASSWORD_QUEUE_LIMIT")
+    args = parser.parse_args(argv)
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    #/list has to really hit the database, not the anonymous page cache
+    os.environ.setdefault('PAGE_CACHE_TTL', '0')
+    #all the logins come from one address, this measures the hashing pool not the rate limit
+    os.environ.setdefault('ADMISSION_ENABLED', '0')
+
+    print(f"{'cost':>4} {'ok':>6} {'503s':>6} {'logins/s':>9} {'p50 ms':>8} {'max ms':>8} {'/list p50 ms':>13}")
+    failed = False
+    for cost in args.costs:
+        r = _run_cost(cost, args)
+        failed = failed or r['other'] > 0
+        print(f"{r['cost']:>4} {r['ok']:>6} {r['shed']:>6} {r['logins_per_sec']:>9.1f} "
+              f"{r['p50_ms']:>8.1f} {r['max_ms']:>8.1f} {r['list_p50_ms']:>13.1f}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#Search benchmark: old ILIKE '%q%' search vs the full-text index
+#
+#Seeds a throwaway sqlite db with N events and times the same searches through
+#both paths. Default sizes are 10k and 100k, add 1M with --sizes if you've got
+#a minute (seeding 1M rows takes a while).
+#
+#   python -m benchmarks.search_bench --sizes 10000 100000 1000000
+#
+#Both paths are timed fetching one page (LIMIT per_page) so the only difference
+#is scan vs index.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+WORDS = ['heated', 'indoor', 'slide', 'saltwater', 'outdoor', 'regular', 'party', 'lap', 'swim',
+         'splash', 'sunset', 'family', 'kids', 'aqua', 'fitness', 'rooftop', 'lagoon', 'spa',
+         'brisbane', 'gold', 'coast', 'sunshine', 'noosa', 'cairns', 'ipswich', 'logan']
+FEATURES = ['heated', 'indoor', 'slide', 'saltwater', 'outdoor', 'regular']
+QUERIES = ['heated', 'sun', 'rooftop party', 'lagoon spa noosa', 'zzz']
+
+
+def _seed(db, Event, User, n, batch=10000):
+    rnd = random.Random(42)
+    host = User(name='host', email='host@example.com', password='x')
+    db.session.add(host)
+    db.session.commit()
+    start = datetime.now()
+    table = Event.__table__
+    for offset in range(0, n, batch):
+        rows = []
+        for i in range(offset, min(n, offset + batch)):
+            rows.append({
+                'title': ' '.join(rnd.choices(WORDS, k=3)).title(),
+                'description': ' '.join(rnd.choices(WORDS, k=20)),
+                'location': rnd.choice(WORDS).title(),
+                'features': rnd.choice(FEATURES),
+                'capacity': 50, 'tickets_sold': 0, 'cost': 10.0, 'status': 'Open',
+                'created_by': host.id, 'date': start + timedelta(minutes=i), 'image_file': 'default.jpg',
+            })
+        db.session.execute(table.insert(), rows)
+    db.session.commit()
+
+
+def _time(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(runs)
+
+
+def run_size(n, repeat, per_page):
+    tmp = tempfile.mkdtemp(prefix='search_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'search.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+
+    from website import create_app, db, search
+    from website.models import Event, User
+    from sqlalchemy import or_
+
+    app = create_app()
+    results = []
+    with app.app_context():
+        db.create_all()
+        t0 = time.perf_counter()
+        _seed(db, Event, User, n)
+        seed_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        search.build_index()
+        index_s = time.perf_counter() - t0
+        print(f"\n{n:,} events (seeded in {seed_s:.1f}s, index built in {index_s:.1f}s)")
+        print(f"  {'query':<20} {'ILIKE ms':>10} {'FTS ms':>10} {'speedup':>9}")
+
+        for q in QUERIES:
+            def ilike():
+                like = f"%{q}%"
+                db.session.scalars(
+                    db.select(Event)
+                    .where(or_(Event.features.ilike(like), Event.title.ilike(like),
+                               Event.description.ilike(like), Event.location.ilike(like)))
+                    .order_by(Event.date.asc())
+                    .limit(per_page)
+                ).all()
+
+            def fts():
+                search.search_events(q, per_page=per_page)
+
+            ilike_ms = _time(ilike, repeat)
+            fts_ms = _time(fts, repeat)
+            results.append({'size': n, 'query': q, 'ilike_ms': ilike_ms, 'fts_ms': fts_ms})
+            print(f"  {q:<20} {ilike_ms:>10.2f} {fts_ms:>10.2f} {ilike_ms / max(fts_ms, 1e-6):>8.1f}x")
+        db.session.remove()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ILIKE vs full-text search benchmark")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--per-page', type=int, default=24)
+    args = parser.parse_args(argv)
+    for n in args.sizes:
+        run_size(n, args.repeat, args.per_page)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
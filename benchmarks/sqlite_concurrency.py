@@ -0,0 +1,105 @@
+#SQLite readers-vs-writer check
+#
+#Holds a write transaction open on the database (BEGIN EXCLUSIVE + an insert, then
+#sleeps) and meanwhile a bunch of threads keep loading /list through the app. With
+#the production profile (WAL) the readers should carry on at normal speed the whole
+#time, with the stock rollback journal they stall until the writer commits.
+#
+#   python -m benchmarks.sqlite_concurrency                      # production profile
+#   python -m benchmarks.sqlite_concurrency --profile default    # for comparison
+#
+#Exits with status 1 if the production profile lets the writer block a reader.
+
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check SQLite readers aren't blocked by a writer")
+    parser.add_argument('--profile', choices=['production', 'default'], default='production')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--hold', type=float, default=2.0, help="seconds the writer keeps its lock")
+    parser.add_argument('--events', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='sqlite_concurrency_')
+    path = os.path.join(tmp, 'bench.sqlite')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + path
+    os.environ['DB_PROFILE'] = args.profile
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    #/list has to really hit the database, not the anonymous page cache
+    os.environ.setdefault('PAGE_CACHE_TTL', '0')
+    #so a blocked reader waits out the whole hold instead of erroring
+    os.environ.setdefault('SQLITE_BUSY_TIMEOUT_MS', str(int((args.hold + 5) * 1000)))
+
+    from website import create_app, db
+    from website.models import User, Event
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        host = User(name='host', email='host@example.com', password='x')
+        db.session.add(host)
+        db.session.commit()
+        start = datetime.now() + timedelta(days=1)
+        db.session.add_all([
+            Event(title=f'Event {i}', location='Pool', capacity=50, cost=5.0, status='Open',
+                  created_by=host.id, date=start + timedelta(hours=i))
+            for i in range(args.events)
+        ])
+        db.session.commit()
+        journal = db.session.execute(db.text("PRAGMA journal_mode")).scalar()
+
+    locked = threading.Event()
+    released = threading.Event()
+
+    def writer():
+        conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+        conn.execute("BEGIN EXCLUSIVE")
+        conn.execute("UPDATE event SET capacity = capacity + 1 WHERE id = 1")
+        locked.set()
+        time.sleep(args.hold)
+        conn.execute("COMMIT")
+        conn.close()
+        released.set()
+
+    def reader(_):
+        client = app.test_client()
+        times = []
+        while not released.is_set():
+            t = time.perf_counter()
+            response = client.get('/list')
+            times.append(time.perf_counter() - t)
+            assert response.status_code == 200, response.status_code
+        return times
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    locked.wait()
+    with ThreadPoolExecutor(max_workers=args.readers) as pool:
+        results = list(pool.map(reader, range(args.readers)))
+    writer_thread.join()
+
+    times = [t for r in results for t in r]
+    worst = max(times)
+    print(f"profile:          {args.profile} (journal_mode={journal})")
+    print(f"writer held lock: {args.hold:.1f}s")
+    print(f"reads completed:  {len(times)} by {args.readers} readers")
+    print(f"read p50:         {statistics.median(times) * 1000:.1f} ms")
+    print(f"read max:         {worst * 1000:.1f} ms")
+
+    blocked = worst > args.hold / 2
+    print("readers were BLOCKED by the writer" if blocked else "readers were not blocked by the writer")
+    return 1 if blocked and args.profile == 'production' else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
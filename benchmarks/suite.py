@@ -0,0 +1,365 @@
+#Site benchmark suite
+#
+#Seeds a fresh database (users, events, bookings, comments - sizes are flags), then
+#drives the main flows through the app and reports p50/p95/p99 latency and
+#requests/sec for each one:
+#   index          GET /
+#   list           GET /list
+#   search         GET /home?q=<word>
+#   view_event     GET /<id>
+#   register_login POST /register then POST /login (new user every time)
+#   book_event     POST /<id>/book
+#   my_bookings    GET /my_bookings
+#
+#By default it goes through the Flask test client (no network, measures just the app).
+#--server runs the app on a real threaded WSGI server and talks HTTP to it instead.
+#
+#Results are saved as JSON (benchmarks/results/<time>-<commit>.json by default) so runs
+#on different commits can be compared:
+#   python -m benchmarks.suite --events 2000 --bookings 20000 --requests 300 --concurrency 8
+#   python -m benchmarks.suite --server --flows list search view_event
+#   python -m benchmarks.suite --compare benchmarks/results/a.json benchmarks/results/b.json
+#
+#The anonymous page cache is off by default so the pages really render, pass
+#--page-cache to measure with it on. Passwords use a low bcrypt cost (--bcrypt-rounds)
+#so the register/login numbers aren't just bcrypt.
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+WORDS = ['pool', 'party', 'swim', 'sunset', 'heated', 'lagoon', 'splash', 'lap', 'float', 'cabana',
+         'rooftop', 'infinity', 'night', 'family', 'aqua', 'tropical', 'chill', 'slide', 'bbq', 'yoga']
+FEATURES = ['heated', 'saltwater', 'indoor', 'outdoor', 'spa', 'slides', 'regular']
+PASSWORD = 'benchpass'
+ALL_FLOWS = ['index', 'list', 'search', 'view_event', 'register_login', 'book_event', 'my_bookings']
+
+
+#---------------------------------------------------------------------------------
+#SEEDING
+#---------------------------------------------------------------------------------
+
+def seed(db, models, users, events, bookings, comments, rng):
+    User, Event, Booking, Comment = models
+    from website import passwords
+    from website.commands import rebuild_ticket_counters
+
+    pw = passwords.hash_password(PASSWORD)
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [
+        {'name': 'host', 'email': 'host@example.com', 'password': pw},
+        *({'name': f'user{i}', 'email': f'user{i}@example.com', 'password': pw} for i in range(users)),
+    ])
+    host_id = db.session.scalar(db.select(User.id).where(User.name == 'host'))
+    user_ids = db.session.scalars(db.select(User.id).where(User.name != 'host')).all()
+
+    db.session.execute(db.insert(Event), [
+        {
+            'title': f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}",
+            'description': ' '.join(rng.choice(WORDS) for _ in range(20)),
+            'location': f"{rng.randint(1, 500)} {rng.choice(WORDS).title()} St",
+            'capacity': 100000, 'tickets_sold': 0, 'cost': float(rng.randint(0, 50)),
+            'status': 'Open', 'features': rng.choice(FEATURES), 'created_by': host_id,
+            'date': now + timedelta(hours=1 + i), 'updated_at': now, 'image_file': 'default.jpg',
+        }
+        for i in range(events)
+    ])
+    event_ids = db.session.scalars(db.select(Event.id)).all()
+
+    if bookings:
+        db.session.execute(db.insert(Booking), [
+            {'user_id': rng.choice(user_ids), 'event_id': rng.choice(event_ids), 'quantity': rng.randint(1, 3),
+             'price': 10.0, 'date': now - timedelta(minutes=rng.randint(0, 100000))}
+            for _ in range(bookings)
+        ])
+    if comments:
+        db.session.execute(db.insert(Comment), [
+            {'text': ' '.join(rng.choice(WORDS) for _ in range(12)), 'user_id': rng.choice(user_ids),
+             'event_id': rng.choice(event_ids), 'date_created': now - timedelta(minutes=rng.randint(0, 100000))}
+            for _ in range(comments)
+        ])
+    db.session.commit()
+    rebuild_ticket_counters()
+    return user_ids, event_ids
+
+
+#---------------------------------------------------------------------------------
+#CLIENTS (same interface for the test client and real http)
+#---------------------------------------------------------------------------------
+
+class TestClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        return self.client.get(path).status_code
+
+    def post(self, path, data):
+        return self.client.post(path, data=data).status_code
+
+
+class HttpClient:
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookies = {}
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{k}={v}" for k, v in self.cookies.items())
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            #server closed the keep-alive connection, reconnect once
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+        response.read()
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return response.status
+
+    def get(self, path):
+        return self._request('GET', path)
+
+    def post(self, path, data):
+        return self._request('POST', path, urlencode(data), {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+#---------------------------------------------------------------------------------
+#FLOWS
+#---------------------------------------------------------------------------------
+#each flow: (needs a logged in client, function(client, rng, ids) -> list of statuses, ok statuses)
+
+def _index(client, rng, ids):
+    return [client.get('/')]
+
+
+def _list(client, rng, ids):
+    return [client.get('/list')]
+
+
+def _search(client, rng, ids):
+    return [client.get('/home?q=' + rng.choice(WORDS))]
+
+
+def _view_event(client, rng, ids):
+    return [client.get(f"/{rng.choice(ids['events'])}")]
+
+
+_registrations = iter(range(10 ** 9))
+_registrations_lock = threading.Lock()
+
+
+def _register_login(client, rng, ids):
+    with _registrations_lock:
+        n = next(_registrations)
+    name = f"new{n}_{rng.randint(0, 10 ** 9)}"
+    registered = client.post('/register', {
+        'user_name': name, 'email': f"{name}@example.com", 'contact_number': '0400000000',
+        'street_address': '1 Bench Street', 'password': PASSWORD, 'confirm': PASSWORD,
+    })
+    logged_in = client.post('/login', {'user_name': name, 'password': PASSWORD})
+    return [registered, logged_in]
+
+
+def _book_event(client, rng, ids):
+    return [client.post(f"/{rng.choice(ids['events'])}/book", {'quantity': 1})]
+
+
+def _my_bookings(client, rng, ids):
+    return [client.get('/my_bookings')]
+
+
+FLOWS = {
+    'index': (False, _index, {200}),
+    'list': (False, _list, {200}),
+    'search': (False, _search, {200}),
+    'view_event': (False, _view_event, {200}),
+    'register_login': (False, _register_login, {302}),
+    'book_event': (True, _book_event, {200}),
+    'my_bookings': (True, _my_bookings, {200}),
+}
+
+
+#---------------------------------------------------------------------------------
+#RUNNER
+#---------------------------------------------------------------------------------
+
+#nearest-rank percentile of a sorted list
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_flow(name, make_client, ids, requests, concurrency, seed_value):
+    needs_login, fn, ok_statuses = FLOWS[name]
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        client = make_client()
+        if needs_login:
+            #each worker is a different user, logging in isn't part of the timing
+            client.post('/login', {'user_name': f"user{index % len(ids['users'])}", 'password': PASSWORD})
+        timings, errors = [], 0
+        for _ in range(per_worker[index]):
+            start = time.perf_counter()
+            statuses = fn(client, rng, ids)
+            timings.append(time.perf_counter() - start)
+            if any(s not in ok_statuses for s in statuses):
+                errors += 1
+        return timings, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    timings = sorted(t for r in results for t in r[0])
+    return {
+        'requests': len(timings),
+        'errors': sum(r[1] for r in results),
+        'seconds': round(elapsed, 4),
+        'rps': round(len(timings) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(timings) / len(timings) * 1000, 3) if timings else 0.0,
+        'p50_ms': round(percentile(timings, 50) * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'p99_ms': round(percentile(timings, 99) * 1000, 3),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'flow':<15} {'p50 ms':>17} {'p95 ms':>17} {'req/s':>17}")
+    for name, after in new['flows'].items():
+        before = old['flows'].get(name)
+        if before is None:
+            continue
+        cells = []
+        for field in ('p50_ms', 'p95_ms', 'rps'):
+            change = (after[field] - before[field]) / before[field] * 100 if before[field] else 0.0
+            cells.append(f"{after[field]:>8.1f} ({change:+5.0f}%)")
+        print(f"{name:<15} " + ' '.join(cells))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the site's main flows")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--bookings', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help="requests per flow")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--flows', nargs='+', choices=ALL_FLOWS, default=ALL_FLOWS)
+    parser.add_argument('--server', action='store_true', help="go through a real threaded WSGI server")
+    parser.add_argument('--page-cache', action='store_true', help="leave the anonymous page cache on")
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1, help="random seed for the data and the requests")
+    parser.add_argument('--output', default=None, help="results json (default benchmarks/results/...)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two results files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+
+    tmp = tempfile.mkdtemp(prefix='bench_suite_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.bcrypt_rounds)
+    os.environ.setdefault('PASSWORD_QUEUE_LIMIT', str(max(8, args.concurrency * 4)))
+    #every simulated user comes from 127.0.0.1, the per-client rate limits would shed them
+    os.environ.setdefault('ADMISSION_ENABLED', '0')
+    if not args.page_cache:
+        os.environ['PAGE_CACHE_TTL'] = '0'
+
+    from website import create_app, db
+    from website.models import User, Event, Booking, Comment
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        user_ids, event_ids = seed(db, (User, Event, Booking, Comment), args.users, args.events,
+                                   args.bookings, args.comments, rng)
+    seed_seconds = time.perf_counter() - start
+    ids = {'users': user_ids, 'events': event_ids}
+    print(f"seeded {args.users} users, {args.events} events, {args.bookings} bookings, "
+          f"{args.comments} comments in {seed_seconds:.1f}s")
+
+    server = None
+    if args.server:
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  #no per-request access log
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        make_client = lambda: HttpClient(server.server_port)
+    else:
+        make_client = lambda: TestClient(app)
+
+    results = {}
+    print(f"{'flow':<15} {'reqs':>6} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name in args.flows:
+        r = run_flow(name, make_client, ids, args.requests, args.concurrency, args.seed)
+        results[name] = r
+        print(f"{name:<15} {r['requests']:>6} {r['errors']:>6} {r['rps']:>8.1f} "
+              f"{r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f}")
+    if server is not None:
+        server.shutdown()
+
+    commit = _commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'mode': 'server' if args.server else 'test_client',
+        'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'seed_seconds': round(seed_seconds, 3),
+        'flows': results,
+    }
+    output = args.output
+    if output is None:
+        results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        os.makedirs(results_dir, exist_ok=True)
+        output = os.path.join(results_dir, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+    return 1 if any(r['errors'] for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#Upload memory benchmark
+#
+#Runs the app on a real threaded WSGI server, then fires concurrent large image
+#uploads at /create and measures how much memory the process allocates while
+#handling them (tracemalloc peak). The clients stream their request bodies from
+#disk so nearly all of the measured memory is the server side.
+#
+#   python -m benchmarks.upload_memory --uploads 16 --concurrency 8 --size-mb 8
+#   python -m benchmarks.upload_memory --mode default   # werkzeug's stock request class
+#
+#--mode streaming (default) uses images.UploadRequest, --mode default swaps back to
+#flask.Request so the two can be compared.
+
+import argparse
+import http.client
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+BOUNDARY = 'benchmarkboundary7d93'
+
+
+def _make_image(path, size_mb):
+    from PIL import Image
+    #random noise barely compresses, so the png ends up close to the target size
+    side = int((size_mb * 1024 * 1024 / 3) ** 0.5)
+    Image.frombytes('RGB', (side, side), os.urandom(side * side * 3)).save(path, 'PNG', compress_level=0)
+
+
+def _make_body(path, image_path):
+    fields = {'title': 'Upload bench', 'location': 'Pool', 'capacity': '10', 'cost': '1.00',
+              'features': 'heated', 'date': '2030-01-01'}
+    with open(path, 'wb') as out:
+        for name, value in fields.items():
+            out.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        out.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="big.png"\r\n'
+                  f'Content-Type: image/png\r\n\r\n'.encode())
+        with open(image_path, 'rb') as image:
+            for chunk in iter(lambda: image.read(1024 * 1024), b''):
+                out.write(chunk)
+        out.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent large upload memory benchmark")
+    parser.add_argument('--uploads', type=int, default=16)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--size-mb', type=float, default=8)
+    parser.add_argument('--mode', choices=['streaming', 'default'], default='streaming')
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='upload_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    os.environ.setdefault('UPLOAD_MAX_BYTES', str(int((args.size_mb + 4) * 1024 * 1024)))
+
+    from flask import Request
+    from flask_bcrypt import generate_password_hash
+    from werkzeug.serving import make_server
+
+    from website import create_app, db, images
+    from website.models import User
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['UPLOAD_MAX_PIXELS'] = 0
+    if args.mode == 'default':
+        app.request_class = Request
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(name='bench', email='bench@example.com',
+                            password=generate_password_hash('bench', 4).decode('utf-8')))
+        db.session.commit()
+
+    #every upload lands in the real static/uploads dir, point it at the temp dir instead
+    upload_root = os.path.join(tmp, 'uploads')
+    os.makedirs(upload_root)
+    images.upload_dir = lambda app=None: upload_root
+    images.queue_variants = lambda filename: None
+
+    image_path = os.path.join(tmp, 'big.png')
+    body_path = os.path.join(tmp, 'body.bin')
+    _make_image(image_path, args.size_mb)
+    _make_body(body_path, image_path)
+    body_size = os.path.getsize(body_path)
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  #no per-request access log
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    #log in once and share the session cookie
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('POST', '/login', urlencode({'user_name': 'bench', 'password': 'bench'}),
+                 {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie').split(';', 1)[0]
+
+    def upload(_):
+        c = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        with open(body_path, 'rb') as body:
+            c.request('POST', '/create', body, {
+                'Content-Type': f'multipart/form-data; boundary={BOUNDARY}',
+                'Content-Length': str(body_size),
+                'Cookie': cookie,
+            })
+            r = c.getresponse()
+            r.read()
+        return r.status
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        statuses = list(pool.map(upload, range(args.uploads)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    server.shutdown()
+
+    ok = sum(1 for s in statuses if s == 302)
+    print(f"mode:            {args.mode}")
+    print(f"uploads:         {args.uploads} x {body_size / 1024 / 1024:.1f} MB, {args.concurrency} at a time ({ok} ok)")
+    print(f"elapsed:         {elapsed:.2f}s ({args.uploads / elapsed:.1f} uploads/sec)")
+    print(f"peak allocated:  {peak / 1024 / 1024:.1f} MB (python heap, all threads)")
+    return 0 if ok == args.uploads else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
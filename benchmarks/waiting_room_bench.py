@@ -0,0 +1,112 @@
+#Ticket-drop stampede, with and without the waiting room
+#
+#--users logged in users all try to book the same event at the same moment. First
+#straight at book_event (everyone hits the seat UPDATE together), then again on an
+#event with a waiting room letting --rate people per minute through: each user joins
+#the queue, polls their place like the waiting page does, and books once let in.
+#For both runs it reports how many bookings went through / failed, the booking
+#latency and the most bookings finished in any one second. Exits with status 1 if
+#any booking through the waiting room failed.
+#
+#   python -m benchmarks.waiting_room_bench --users 200 --rate 1200
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+def _summary(name, results, elapsed):
+    ok = [r for r in results if r['ok']]
+    book_times = sorted(r['book_secs'] for r in ok)
+    per_second = {}
+    for r in ok:
+        second = int(r['done_at'])
+        per_second[second] = per_second.get(second, 0) + 1
+    waits = [r['queued_secs'] for r in results if r['queued_secs'] is not None]
+    print(f"{name:<15} {len(ok):>6} {len(results) - len(ok):>7} "
+          f"{statistics.median(book_times) * 1000 if ok else 0:>8.1f} "
+          f"{book_times[int(len(book_times) * 0.95) - 1] * 1000 if ok else 0:>8.1f} "
+          f"{max(per_second.values()) if per_second else 0:>8} "
+          f"{max(waits) if waits else 0:>9.1f} {elapsed:>7.1f}")
+    return len(results) - len(ok)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Booking stampede with and without the waiting room")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--rate', type=int, default=1200, help="waiting room bookings per minute")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix='waiting_room_bench_')
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'bench.sqlite')
+    os.environ.setdefault('FLASK_DEBUG', '0')
+    os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+    #every user comes from the same address, the per-client limits would get in the way
+    os.environ.setdefault('ADMISSION_ENABLED', '0')
+
+    from website import create_app, db, passwords
+    from website.models import User, Event
+
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    with app.app_context():
+        db.create_all()
+        password = passwords.hash_password('pw')
+        host = User(name='host', email='host@example.com', password=password)
+        db.session.add(host)
+        db.session.add_all([User(name=f'user{i}', email=f'user{i}@example.com', password=password)
+                            for i in range(args.users)])
+        db.session.commit()
+        when = datetime.now() + timedelta(days=7)
+        direct = Event(title='Ticket drop', location='Pool', capacity=args.users * 2, cost=5.0,
+                       status='Open', created_by=host.id, date=when)
+        queued = Event(title='Ticket drop (queued)', location='Pool', capacity=args.users * 2, cost=5.0,
+                       status='Open', created_by=host.id, date=when, waiting_room_rate=args.rate)
+        db.session.add_all([direct, queued])
+        db.session.commit()
+        direct_id, queued_id = direct.id, queued.id
+
+    def stampede(event_id, use_queue):
+        clients = []
+        for i in range(args.users):
+            client = app.test_client()
+            client.post('/login', data={'user_name': f'user{i}', 'password': 'pw'})
+            clients.append(client)
+        go = threading.Barrier(args.users)
+
+        def user(client):
+            go.wait()
+            queued_secs = None
+            if use_queue:
+                start = time.perf_counter()
+                client.get(f'/{event_id}/queue')
+                while True:
+                    queue = client.get(f'/{event_id}/queue/status').get_json()
+                    if queue.get('admitted'):
+                        break
+                    time.sleep(min(0.5, queue['wait_seconds'] or 0.05))
+                queued_secs = time.perf_counter() - start
+            start = time.perf_counter()
+            response = client.post(f'/{event_id}/book', data={'quantity': 1})
+            return {'ok': response.status_code == 200, 'book_secs': time.perf_counter() - start,
+                    'done_at': time.time(), 'queued_secs': queued_secs}
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as pool:
+            results = list(pool.map(user, clients))
+        return results, time.perf_counter() - start
+
+    print(f"{'run':<15} {'booked':>6} {'failed':>7} {'p50 ms':>8} {'p95 ms':>8} {'max/sec':>8} {'max wait s':>9} {'total s':>7}")
+    _summary('direct', *stampede(direct_id, False))
+    failed = _summary(f'queue {args.rate}/min', *stampede(queued_id, True))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
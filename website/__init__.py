@@ -1,12 +1,14 @@
 
 #bunch of imports
 import os
-from flask import Flask, render_template
+from flask import Flask, g, jsonify, render_template, request
 from flask_bootstrap import Bootstrap5
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, current_user
 import logging
-db = SQLAlchemy()
+from .replicas import RoutingSession
+#RoutingSession sends reads from @replica_reads views to a replica when one is set up (replicas.py)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 #=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/=/
 #NOTE ON FLASK APP LOCATION AND ERROR HANDLERS:
@@ -41,10 +43,71 @@ def create_app():
     app.secret_key = os.environ.get('SECRET_KEY', 'somesecretkey')  #replace in prod
     #below sets the uri that tells the application where to find its database
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URI', 'sqlite:///sitedata.sqlite')
+    #how many cards the listing pages (/list, /home, /my_bookings) show per page
+    app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', '24'))
+    #how many search results /home shows per page
+    app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', '24'))
+    #how many comments view_event shows at once (older ones load on demand)
+    app.config['COMMENT_PAGE_SIZE'] = int(os.environ.get('COMMENT_PAGE_SIZE', '20'))
     
+    #event card fragment cache (see fragment_cache.py): lru (default) or none
+    app.config['CARD_CACHE_BACKEND'] = os.environ.get('CARD_CACHE_BACKEND', 'lru')
+    app.config['CARD_CACHE_SIZE'] = int(os.environ.get('CARD_CACHE_SIZE', '2048'))
+    #whole-page cache for anonymous visitors (see page_cache.py), PAGE_CACHE_TTL=0 turns it off
+    app.config['PAGE_CACHE_TTL'] = float(os.environ.get('PAGE_CACHE_TTL', '30'))
+    app.config['PAGE_CACHE_STALE'] = float(os.environ.get('PAGE_CACHE_STALE', '60'))
+    app.config['PAGE_CACHE_SIZE'] = int(os.environ.get('PAGE_CACHE_SIZE', '512'))
+
+    #per-request timings, SQL counts, slow query log and the /metrics endpoint (metrics.py)
+    #set up first so its after_request hook runs last and times the whole request
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', '200'))
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    from . import metrics
+    metrics.init_app(app)
+
+    #engine settings (WAL/busy_timeout for sqlite, pool sizes for postgres), see db_profile.py
+    #DB_PROFILE=default leaves SQLAlchemy's defaults alone
+    from . import db_profile
+    db_profile.configure(app)
+
+    #read replicas (comma separated uris), browsing pages read from these, see replicas.py
+    from . import replicas
+    replica_uris = [uri.strip() for uri in os.environ.get('DATABASE_REPLICA_URIS', '').split(',') if uri.strip()]
+    replicas.configure(app, replica_uris)
+    app.config['REPLICA_STICKY_SECONDS'] = float(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+
     #Initialise extensions
     db.init_app(app)
+    db_profile.init_app(app, db)
+    replicas.init_app(app)
     Bootstrap5(app)
+    from . import fragment_cache
+    fragment_cache.init_app(app)
+    from . import page_cache
+    page_cache.init_app(app)
+
+    #uploaded images: resized variants are made by a small background pool (images.py)
+    #and templates get picture_sources() for the event_picture macro
+    app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', '2'))
+    from . import images
+    app.jinja_env.globals['picture_sources'] = images.picture_sources
+
+    #upload limits /-/-/-/
+    # - UploadRequest streams file parts straight into a temp file instead of memory
+    # - MAX_CONTENT_LENGTH makes werkzeug refuse a too-big request (413) before
+    #   reading the whole body, a bit of headroom is left for the other form fields
+    # - UPLOAD_MAX_PIXELS stops tiny files that decode into enormous images
+    app.request_class = images.UploadRequest
+    app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+    app.config['UPLOAD_MAX_PIXELS'] = int(os.environ.get('UPLOAD_MAX_PIXELS', str(40_000_000)))
+    app.config['MAX_CONTENT_LENGTH'] = app.config['UPLOAD_MAX_BYTES'] + 64 * 1024
+
+    #static files: fingerprinted + precompressed copies with far-future caching (assets.py)
+    #off in debug by default so css edits show up without rebuilding
+    app.config['STATIC_FINGERPRINT'] = os.environ.get('STATIC_FINGERPRINT', '0' if app.debug else '1') == '1'
+    from . import assets
+    assets.init_app(app)
 
     #flask-login helps manage user sessions (login/logout) and restricts
     #access to certain routes using @login_required <- helps with literally everything
@@ -52,20 +115,57 @@ def create_app():
     login_manager.login_view = 'auth.login' #redirects
     login_manager.init_app(app)
 
-    #Import models inside factory to avoid circular imports during import time
-    from .models import User
+    #tells flask-login how to load a user by ID.
+    # - flask stores the user_id in the session cookie
+    # - on each request, it calls the loader to get the user object
+    #the loader lives in user_cache.py and keeps a short lived copy of each user's
+    #id/name/email so most requests don't need to hit the database for it
+    app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', '60'))
+    app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+    from . import user_cache
+    user_cache.init_app(app, login_manager)
 
+    #password hashing runs in a bounded bcrypt pool (passwords.py), when it's full
+    #logins/registrations get a quick 503 instead of piling up on the workers
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', '12'))
+    app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', str(os.cpu_count() or 2)))
+    app.config['PASSWORD_QUEUE_LIMIT'] = int(os.environ.get('PASSWORD_QUEUE_LIMIT', str(app.config['PASSWORD_WORKERS'] * 4)))
+    app.config['PASSWORD_TIMEOUT'] = float(os.environ.get('PASSWORD_TIMEOUT', '30'))
+    from . import passwords
+    passwords.init_app(app)
 
-    #tells flask-login how to load a user from the database by ID.
-    # - flask stores the user_id in the session cookie
-    # - on each request, it calls this function to retrieve the user object
-    @login_manager.user_loader
-    def load_user(user_id):
-        try:
-            uid = int(user_id) #ensures id is integer
-        except (TypeError, ValueError):
-            return None
-        return db.session.scalar(db.select(User).where(User.id == uid))
+    #rate limits + in-flight cap on the login/register/booking/comment POSTs (admission.py)
+    #RATE_LIMIT_LOGIN / _REGISTER / _BOOKING / _COMMENT = "<requests>/<seconds>"
+    app.config['ADMISSION_ENABLED'] = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+    app.config['ADMISSION_MAX_INFLIGHT'] = int(os.environ.get('ADMISSION_MAX_INFLIGHT', '32'))
+    for rule in ('LOGIN', 'REGISTER', 'BOOKING', 'COMMENT'):
+        app.config[f'RATE_LIMIT_{rule}'] = os.environ.get(f'RATE_LIMIT_{rule}')
+    from . import admission
+    admission.init_app(app)
+
+    #behind a reverse proxy (nginx etc) set PROXY_COUNT to how many proxies are in front
+    #of the app, then request.remote_addr / scheme / host come from their X-Forwarded-*
+    #headers. Without it every logged out client looks like the proxy's address and
+    #they'd all share one login/register rate limit
+    proxy_count = int(os.environ.get('PROXY_COUNT', '0'))
+    if proxy_count > 0:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_count, x_proto=proxy_count, x_host=proxy_count)
+
+    #opt-in waiting room per event (Event.waiting_room_rate, see waiting_room.py)
+    #WAITING_ROOM_HOLD = seconds a let-in user keeps the booking form, WAITING_ROOM_POLL = page poll interval
+    app.config['WAITING_ROOM_HOLD'] = int(os.environ.get('WAITING_ROOM_HOLD', '300'))
+    app.config['WAITING_ROOM_POLL'] = int(os.environ.get('WAITING_ROOM_POLL', '5'))
+    from . import waiting_room
+    waiting_room.init_app(app)
+
+    #live tickets left / status on view_event over Server-Sent Events (live.py)
+    #LIVE_POLL_SECONDS = how often each worker checks for changes made by other workers
+    app.config['LIVE_POLL_SECONDS'] = float(os.environ.get('LIVE_POLL_SECONDS', '2'))
+    app.config['LIVE_KEEPALIVE_SECONDS'] = float(os.environ.get('LIVE_KEEPALIVE_SECONDS', '15'))
+    app.config['LIVE_MAX_CONNECTIONS'] = int(os.environ.get('LIVE_MAX_CONNECTIONS', '1000'))
+    from . import live
+    live.init_app(app)
 
     #Register blueprints /-/-/-/
     #each blueprint contains a group of related routes (views, auth, events)
@@ -79,6 +179,65 @@ def create_app():
     from . import events
     app.register_blueprint(events.events_bp)
 
+    #JSON API for the mobile app / kiosk (/api/v1, see api.py)
+    from . import api
+    app.register_blueprint(api.api_bp)
+
+    #bulk NDJSON/CSV import/export (bulk.py), the /admin endpoints need ADMIN_TOKEN set
+    #BULK_IMPORT_MAX_BYTES caps an uploaded import file (default 2GB, MAX_CONTENT_LENGTH is for images)
+    app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+    app.config['BULK_BATCH_SIZE'] = int(os.environ.get('BULK_BATCH_SIZE', '5000'))
+    app.config['BULK_IMPORT_MAX_BYTES'] = int(os.environ.get('BULK_IMPORT_MAX_BYTES', str(2 * 1024 ** 3)))
+    from . import bulk
+    app.register_blueprint(bulk.admin_bp)
+
+    #CLI commands (flask reconcile-tickets etc) live in commands.py
+    from . import commands
+    for command in commands.ALL_COMMANDS:
+        app.cli.add_command(command)
+
+    #Schema migrations /-/-/-/
+    #brings an existing sitedata.sqlite up to date (new columns, indexes, search
+    #index) before we serve anything, see migrations.py. Set AUTO_MIGRATE=0 to
+    #turn this off and run `flask db-upgrade` yourself instead.
+    if os.environ.get('AUTO_MIGRATE', '1') == '1':
+        from . import migrations
+        with app.app_context():
+            migrations.upgrade()
+
+    #Scheduled status refresh /-/-/-/
+    #if STATUS_REFRESH_INTERVAL (seconds) is set we run the status job in a
+    #background thread, otherwise it's left to cron + `flask refresh-statuses`
+    #(the WERKZEUG_RUN_MAIN check stops the debug reloader's parent process
+    #from starting a second copy)
+    status_interval = float(os.environ.get('STATUS_REFRESH_INTERVAL', '0'))
+    if status_interval > 0 and (not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        from .status_worker import start_scheduler
+        start_scheduler(app, status_interval)
+
+    #Query counter /-/-/-/
+    #queries.py counts every SQL statement run during a request (on flask.g).
+    #In debug (or when QUERY_COUNT_HEADER is set) we send the count back as a
+    #response header so we can check the listing pages run a fixed number of
+    #statements no matter how many cards they render.
+    from . import queries
+    app.config.setdefault('QUERY_COUNT_HEADER', os.environ.get('QUERY_COUNT_HEADER', '1' if app.debug else '0') == '1')
+
+    @app.after_request
+    def add_query_count(response):
+        if app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(queries.query_count())
+            #which database served the reads (primary or replica_N)
+            response.headers['X-DB-Route'] = g.get('db_replica') or 'primary'
+            #card cache hits/misses for this request, if it rendered any cards
+            cards = g.get('card_cache')
+            if cards:
+                response.headers['X-Card-Cache'] = f"hits={cards['hits']}; misses={cards['misses']}"
+            #whether current_user came from the user cache (only set for logged in requests)
+            if g.get('user_cache'):
+                response.headers['X-User-Cache'] = g.user_cache
+        return response
+
     #Template context processor to inject current user info <--------------------
     #This function automatically injects variables into all templates rendered
     #by the app (so then we don’t have to manually pass like user details each time)
@@ -123,6 +282,32 @@ def create_app():
         #this gonna return a friendly 404 page when a route is not found for the user
         return render_template("error.html", message="Page not found"), 404
 
+    #request body bigger than MAX_CONTENT_LENGTH (basically a huge image upload)
+    @app.errorhandler(413)
+    def too_large_413(e):
+        return render_template("error.html", message="That upload is too large"), 413
+
+    #password pool is full (lots of logins at once), ask the browser to retry shortly
+    @app.errorhandler(passwords.PasswordPoolBusy)
+    def password_pool_busy_503(e):
+        return render_template("error.html", message="We're a bit busy right now, please try again in a moment"), 503, {'Retry-After': '2'}
+
+    #shed by admission control: too many from this client (429) or too many at once (503)
+    #the api gets JSON, pages get the normal error page
+    def shed(message, status, retry_after):
+        headers = {'Retry-After': str(retry_after)}
+        if request.blueprint == 'api':
+            return jsonify(error=message), status, headers
+        return render_template("error.html", message=message), status, headers
+
+    @app.errorhandler(admission.RateLimited)
+    def rate_limited_429(e):
+        return shed("You're doing that too often, please wait a moment and try again", 429, e.retry_after)
+
+    @app.errorhandler(admission.Overloaded)
+    def overloaded_503(e):
+        return shed("We're a bit busy right now, please try again in a moment", 503, e.retry_after)
+
     #We are using e here tho for the logging stuff
     @app.errorhandler(Exception)
     def internal_error(e):
@@ -0,0 +1,223 @@
+#commented
+
+#Admission control for the expensive POSTs
+#
+#Logging in / registering (bcrypt), booking and posting a comment all write to the
+#db and nothing stopped one client (or a ticket-drop stampede) from firing them as
+#fast as it could until every worker was busy and browsing died too. Now those
+#views are wrapped with @admit('<rule>'):
+# - a token bucket per rule + client (the logged in user, else the IP address).
+#   RATE_LIMIT_<RULE> = "<requests>/<seconds>", e.g. "10/60" means bursts of up to
+#   10 and then one more every 6s. Over the limit -> 429 with Retry-After
+# - one in-flight cap shared by all of these views (ADMISSION_MAX_INFLIGHT per worker).
+#   When that many are already running the next one gets a 503 + Retry-After right
+#   away instead of queueing behind them, so GET pages keep their workers
+#Only POSTs are checked, the GET forms on the same views are never limited.
+#Both checks are in memory and happen before the view runs (no db, no bcrypt).
+#The in-flight cap is checked first, so a request shed with a 503 doesn't use up
+#the client's rate limit. Views that take more than one kind of POST (view_event:
+#comment or cancel) use `with limited('<rule>'):` around just the limited part.
+#
+#"The IP address" is request.remote_addr. Behind a reverse proxy that's the proxy
+#for everyone, so set PROXY_COUNT (see create_app) to the number of proxies in
+#front of the app and the client's address is taken from X-Forwarded-For instead.
+#
+#Backends for the buckets (same idea as fragment_cache.py):
+# - MemoryBackend -> per worker, real token buckets (default)
+# - SharedBackend -> any redis-style client (incr / expire) in ADMISSION_CLIENT so all
+#                    workers share the limits. Fixed windows: up to <requests> per
+#                    <seconds> window, which is close enough to the bucket
+#ADMISSION_ENABLED=0 turns the whole thing off (benchmarks do this).
+#
+#Admitted / rate limited / overloaded counts per rule are in stats() and /metrics.
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+
+#rule -> default "requests/seconds" (override with RATE_LIMIT_<RULE>)
+DEFAULT_LIMITS = {
+    'login': '10/60',
+    'register': '5/300',
+    'booking': '20/60',
+    'comment': '10/60',
+}
+
+
+#Over the rule's rate for this client -> 429
+class RateLimited(Exception):
+    def __init__(self, rule, retry_after):
+        super().__init__(rule)
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+#Too many of these requests already running in this worker -> 503
+class Overloaded(Exception):
+    def __init__(self, rule, retry_after=1):
+        super().__init__(rule)
+        self.rule = rule
+        self.retry_after = retry_after
+
+
+#parse "10/60" -> (10, 60.0), both have to be above 0
+def parse_limit(text):
+    count, _, seconds = str(text).partition('/')
+    try:
+        count, seconds = int(count), float(seconds or 1)
+    except ValueError:
+        count = seconds = 0
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"Bad rate limit {text!r}, expected \"<requests>/<seconds>\" with both above 0")
+    return count, seconds
+
+
+#In-process token buckets, one per worker
+#key -> (tokens left, when it was last topped up). Only the newest max_keys clients
+#are remembered, an evicted client just starts again with a full bucket
+class MemoryBackend:
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    #take a token, returns 0 if allowed, else seconds until the next token
+    def take(self, key, count, seconds):
+        rate = count / seconds
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (count, now))
+            tokens = min(count, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+#Fixed-window counters in a redis-style store shared by every worker
+class SharedBackend:
+    def __init__(self, client, prefix='admit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key, count, seconds):
+        now = time.time()
+        window = int(now // seconds)
+        name = f"{self.prefix}{key}:{window}"
+        used = self.client.incr(name)
+        if used == 1:
+            self.client.expire(name, int(math.ceil(seconds)) + 1)
+        if used <= count:
+            return 0
+        return (window + 1) * seconds - now
+
+
+#Per worker cap on how many admitted requests are running at once
+class InFlight:
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            if self.limit and self.running >= self.limit:
+                return False
+            self.running += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.running -= 1
+
+
+#rule -> {'admitted': n, 'rate_limited': n, 'overloaded': n}, per worker
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(rule, result):
+    with _stats_lock:
+        counts = _stats.setdefault(rule, {'admitted': 0, 'rate_limited': 0, 'overloaded': 0})
+        counts[result] += 1
+
+
+def stats():
+    with _stats_lock:
+        return {rule: dict(counts) for rule, counts in _stats.items()}
+
+
+def _client():
+    if current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+#Check a request against a rule: raises RateLimited / Overloaded, otherwise returns
+#the InFlight it was counted in (call .leave() when done), or None if not limited
+def check(rule):
+    state = current_app.extensions.get('admission')
+    if state is None or request.method != 'POST':
+        return None
+    #in-flight first: a request we shed anyway mustn't cost the client a token
+    inflight = state['inflight']
+    if not inflight.enter():
+        _count(rule, 'overloaded')
+        raise Overloaded(rule)
+    count, seconds = state['limits'][rule]
+    wait = state['backend'].take(f"{rule}:{_client()}", count, seconds)
+    if wait:
+        inflight.leave()
+        _count(rule, 'rate_limited')
+        raise RateLimited(rule, max(1, int(math.ceil(wait))))
+    _count(rule, 'admitted')
+    return inflight
+
+
+#The same checks around part of a view:  with limited('comment'): ...
+@contextmanager
+def limited(rule):
+    inflight = check(rule)
+    try:
+        yield
+    finally:
+        if inflight is not None:
+            inflight.leave()
+
+
+#View decorator, goes under @login_required so the bucket is per user there
+def admit(rule):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with limited(rule):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    if not app.config.get('ADMISSION_ENABLED', True):
+        app.extensions['admission'] = None
+        return
+    limits = {rule: parse_limit(app.config.get(f'RATE_LIMIT_{rule.upper()}') or default)
+              for rule, default in DEFAULT_LIMITS.items()}
+    client = app.config.get('ADMISSION_CLIENT')
+    backend = SharedBackend(client) if client is not None else MemoryBackend(app.config.get('ADMISSION_MAX_KEYS', 10000))
+    app.extensions['admission'] = {
+        'limits': limits,
+        'backend': backend,
+        'inflight': InFlight(app.config.get('ADMISSION_MAX_INFLIGHT', 32)),
+    }
@@ -0,0 +1,237 @@
+#commented
+
+#JSON API  (/api/v1)
+#
+#The mobile app and the kiosk were scraping our html pages. This blueprint gives them
+#the same data as JSON:
+#   GET  /api/v1/events?after=<cursor>&limit=<n>     upcoming events, keyset paged like /list
+#   GET  /api/v1/events/search?q=<term>&page=<n>     ranked search like /home
+#   GET  /api/v1/events/<id>                         one event incl. tickets_left
+#   GET  /api/v1/events/<id>/comments?after=<cursor> its comments, newest first, keyset paged
+#   POST /api/v1/events/<id>/bookings                {"quantity": 2} -> 201 + the booking
+#
+#Conditional GETs: every GET answer has a weak ETag worked out from the events'
+#version (id + updated_at + status, updated_at is bumped on every change to the row).
+#A client polling with If-None-Match gets an empty 304 back and we skip building the
+#JSON at all. Only the single event also has a Last-Modified (If-Modified-Since):
+#on a list the newest updated_at doesn't change when an event drops off it (passed,
+#deleted, the page moved on), so that would hand out 304s for a stale list. The
+#list ETags include which rows are on the page, so they don't have that problem.
+#
+#Uses the same queries as the pages (queries.py / search.py) so no extra N+1s.
+#Booking needs a logged in session (the normal login cookie) and a JSON body, the
+#JSON content type also keeps other sites from posting here with a plain form.
+
+import hashlib
+from datetime import timezone
+
+from flask import Blueprint, current_app, jsonify, request, url_for
+from flask_login import current_user
+
+from . import db, queries, search, waiting_room
+from .booking import reserve_seats, BookingError
+from .fragment_cache import invalidate_event
+from .models import Event
+from .replicas import replica_reads
+from .admission import admit
+
+api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+#biggest page a client can ask for
+MAX_LIMIT = 100
+
+
+def _error(status, message):
+    return jsonify(error=message), status
+
+
+#---------------------------------------------------------------------------------
+#SERIALIZERS (plain dicts, only columns that are already loaded)
+#---------------------------------------------------------------------------------
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def event_json(event):
+    return {
+        'id': event.id,
+        'title': event.title,
+        'description': event.description,
+        'location': event.location,
+        'date': _iso(event.date),
+        'cost': event.cost,
+        'capacity': event.capacity,
+        'tickets_left': event.tickets_left,
+        'comment_count': event.comment_count,
+        'waiting_room': bool(event.waiting_room_rate),
+        'status': event.status,
+        'features': event.features,
+        'image': url_for('static', filename='uploads/' + (event.image_file or 'default.jpg')),
+        'created_by': {'id': event.created_by, 'name': event.creator.name if event.creator else None},
+        'updated_at': _iso(event.updated_at),
+        'url': url_for('api.event_detail', event_id=event.id),
+    }
+
+
+def comment_json(comment):
+    return {
+        'id': comment.id,
+        'text': comment.text,
+        'date_created': _iso(comment.date_created),
+        'author': comment.author.name if comment.author else None,
+    }
+
+
+def booking_json(booking):
+    return {
+        'id': booking.id,
+        'event_id': booking.event_id,
+        'quantity': booking.quantity,
+        'price': booking.price,
+        'date': _iso(booking.date),
+    }
+
+
+#---------------------------------------------------------------------------------
+#CONDITIONAL GET
+#---------------------------------------------------------------------------------
+
+#weak ETag from the parts that make up a response's version
+def _etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+#Send build() as JSON unless the client already has this version (-> 304)
+#etag/last_modified are worked out from the rows BEFORE serializing anything
+#last_modified=None for lists (see the top of the file)
+def _conditional(etag, last_modified, build):
+    if last_modified is not None:
+        #http dates have no microseconds, and ours are naive utc
+        last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        fresh = (last_modified is not None and request.if_modified_since is not None
+                 and last_modified <= request.if_modified_since)
+
+    response = current_app.response_class(status=304) if fresh else jsonify(build())
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    #clients can reuse it but must check back each time (that's the cheap 304)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _events_version(events):
+    return [(e.id, e.updated_at, e.status) for e in events]
+
+
+def _limit():
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE'], type=int)
+    return max(1, min(limit, MAX_LIMIT))
+
+
+#---------------------------------------------------------------------------------
+#ROUTES
+#---------------------------------------------------------------------------------
+
+@api_bp.route('/events')
+@replica_reads
+def events_list():
+    after = request.args.get('after')
+    events, next_cursor = queries.upcoming_events(after=after, limit=_limit())
+    return _conditional(
+        _etag('events', after, next_cursor, _events_version(events)),
+        None,
+        lambda: {'events': [event_json(e) for e in events], 'next': next_cursor},
+    )
+
+
+@api_bp.route('/events/search')
+@replica_reads
+def events_search():
+    term = request.args.get('q', '').strip()
+    if not term:
+        return _error(400, "q is required")
+    page = max(1, request.args.get('page', 1, type=int))
+    events, has_more = search.search_events(term, page=page, per_page=_limit())
+    return _conditional(
+        _etag('search', term, page, has_more, _events_version(events)),
+        None,
+        lambda: {'events': [event_json(e) for e in events], 'page': page,
+                 'next_page': page + 1 if has_more else None},
+    )
+
+
+@api_bp.route('/events/<int:event_id>')
+@replica_reads
+def event_detail(event_id):
+    event = db.session.get(Event, event_id)
+    if event is None:
+        return _error(404, "Event not found")
+    return _conditional(
+        _etag('event', event.id, event.updated_at, event.status),
+        event.updated_at,
+        lambda: event_json(event),
+    )
+
+
+@api_bp.route('/events/<int:event_id>/comments')
+@replica_reads
+def event_comments(event_id):
+    if db.session.get(Event, event_id) is None:
+        return _error(404, "Event not found")
+    after = request.args.get('after')
+    comments, next_cursor = queries.event_comments(event_id, after=after, limit=_limit())
+    return _conditional(
+        _etag('comments', event_id, after, next_cursor, [c.id for c in comments]),
+        None,
+        lambda: {'comments': [comment_json(c) for c in comments], 'next': next_cursor},
+    )
+
+
+@api_bp.route('/events/<int:event_id>/bookings', methods=['POST'])
+@admit('booking')
+def create_booking(event_id):
+    if not current_user.is_authenticated:
+        return _error(401, "Log in first")
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return _error(415, "Send a JSON body like {\"quantity\": 1}")
+    qty = data.get('quantity')
+    if not isinstance(qty, int) or isinstance(qty, bool) or qty < 1:
+        return _error(400, "quantity must be a whole number of at least 1")
+
+    event = db.session.get(Event, event_id)
+    if event is None:
+        return _error(404, "Event not found")
+    #same rules as events.book_event
+    if event.created_by == current_user.id:
+        return _error(409, "You created this event, so you can't book tickets for it.")
+    if event.status.lower() != 'open':
+        return _error(409, f"This event is currently {event.status} and cannot be booked.")
+    #waiting room on-sales: join the queue first (GET the queue url, then poll it)
+    #claim() also uses the place up, so it books once
+    if not waiting_room.claim(event):
+        response = jsonify(error="This on-sale has a waiting room, it isn't your turn yet.",
+                           queue=url_for('events.join_queue', event_id=event.id),
+                           status=url_for('events.queue_status', event_id=event.id))
+        response.status_code = 409
+        return response
+
+    try:
+        booking, tickets_left = reserve_seats(event.id, current_user.id, qty, event.cost)
+    except BookingError as e:
+        waiting_room.unclaim(event)
+        return _error(409, str(e))
+    invalidate_event(event.id)
+
+    body = booking_json(booking)
+    body['tickets_left'] = tickets_left
+    response = jsonify(body)
+    response.status_code = 201
+    response.headers['Location'] = url_for('api.event_detail', event_id=event.id)
+    return response
@@ -0,0 +1,210 @@
+#commented
+
+#Static asset pipeline
+#
+#Flask's built-in static route serves site.css and the images with no cache busting,
+#so browsers either re-download them or keep a stale copy after we change them. This:
+# 1. fingerprints every file in website/static (except uploads/) by copying it to
+#       static/dist/<path>/<name>.<12 chars of sha256>.<ext>
+#    and writes static/dist/manifest.json  (original path -> hashed copy)
+# 2. writes precompressed .gz (and .br if the brotli package is installed) copies of
+#    the text files next to the hashed copy (png/jpg are already compressed so they're skipped)
+# 3. rewrites url_for('static', filename='css/site.css') to the hashed name (url_defaults hook)
+# 4. replaces the static view: hashed files get a year long "immutable" Cache-Control,
+#    the best precompressed copy for the browser's Accept-Encoding, and a strong ETag
+#    so If-None-Match is answered with a 304
+#
+#A changed file gets a new hash -> new url, so caching forever is safe.
+#Uploads already have content-hash names (images.py) so those get the immutable
+#header too, the old hand-named uploads keep the normal revalidate-every-time caching.
+#
+#It runs on startup when STATIC_FINGERPRINT=1 (the default outside debug, so editing
+#site.css locally doesn't need a rebuild) and can be run on deploy with:
+#   flask --app main build-assets
+#Startup never deletes anything from dist/: other workers may be booting at the same
+#time (their .tmp files) and old workers still serve the old hashes from their own
+#manifest. Once the old workers are gone, clean up with:
+#   flask --app main build-assets --prune
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  #pragma: no cover - brotli is optional
+    brotli = None
+
+DIST = 'dist'
+#folders under static/ that are NOT fingerprinted
+SKIP = {'uploads', DIST}
+#only these are worth compressing
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ico'}
+#one year, the usual "forever" for immutable assets
+ONE_YEAR = 365 * 24 * 60 * 60
+
+#content-hash upload names from images.save_upload (plus their -card/-hero variants)
+_HASHED_UPLOAD = re.compile(r'^uploads/(variants/)?[0-9a-f]{32}(-[a-z]+)?\.\w+$')
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+#write to a temp name then rename, so a half written file is never served
+def _write_atomic(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+#fingerprint + precompress everything in static/, returns the manifest
+#each entry: {"file": "dist/css/site.<hash>.css", "hash": "<hash>", "encodings": ["br", "gzip"]}
+#files that are already built are left alone
+def build_assets(app=None):
+    app = app or current_app
+    static_dir = app.static_folder
+    dist_dir = os.path.join(static_dir, DIST)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir:
+            dirs[:] = [d for d in dirs if d not in SKIP]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            digest = _sha256(source)[:12]
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{stem}.{digest}{ext}"
+            target = os.path.join(dist_dir, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            if not os.path.exists(target):
+                tmp = f"{target}.{os.getpid()}.tmp"
+                shutil.copyfile(source, tmp)
+                os.replace(tmp, target)
+
+            encodings = []
+            if ext.lower() in COMPRESSIBLE:
+                with open(source, 'rb') as f:
+                    data = f.read()
+                if brotli is not None:
+                    if not os.path.exists(target + '.br'):
+                        _write_atomic(target + '.br', brotli.compress(data, quality=11))
+                    encodings.append('br')
+                if not os.path.exists(target + '.gz'):
+                    #mtime=0 so the same input always gives the same bytes
+                    _write_atomic(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                encodings.append('gzip')
+
+            manifest[rel] = {'file': f"{DIST}/{hashed}", 'hash': digest, 'encodings': encodings}
+
+    os.makedirs(dist_dir, exist_ok=True)
+    _write_atomic(os.path.join(dist_dir, 'manifest.json'),
+                  json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+#remove the old hashes of files that have since changed (anything in dist/ the
+#manifest doesn't point at), returns how many files went
+#.tmp files are someone else's build in progress, they're never touched
+def prune_assets(manifest, app=None):
+    app = app or current_app
+    static_dir = app.static_folder
+    dist_dir = os.path.join(static_dir, DIST)
+    keep = set()
+    for entry in manifest.values():
+        keep.add(entry['file'])
+        for encoding in entry['encodings']:
+            keep.add(entry['file'] + {'br': '.br', 'gzip': '.gz'}[encoding])
+    removed = 0
+    for root, _, files in os.walk(dist_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            if name.endswith('.tmp') or rel in keep or name == 'manifest.json':
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def init_app(app):
+    manifest = {}
+    if app.config.get('STATIC_FINGERPRINT'):
+        try:
+            manifest = build_assets(app)
+        except OSError as e:
+            #read-only deploy dir etc -> fall back to plain static files
+            app.logger.warning("Static fingerprinting disabled: %s", e)
+    #hashed path -> (original path, entry) for the static view
+    by_file = {entry['file']: (rel, entry) for rel, entry in manifest.items()}
+    app.extensions['static_manifest'] = manifest
+
+    #url_for('static', filename='css/site.css') -> /static/dist/css/site.<hash>.css
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static':
+            entry = manifest.get(values.get('filename'))
+            if entry:
+                values['filename'] = entry['file']
+
+    def static(filename):
+        found = by_file.get(filename)
+        if found:
+            rel, entry = found
+            #best precompressed copy the browser accepts
+            encoding = next((e for e in entry['encodings'] if e in request.accept_encodings), None)
+            suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding, '')
+            response = send_from_directory(
+                app.static_folder, filename + suffix,
+                mimetype=mimetypes.guess_type(rel)[0] or 'application/octet-stream',
+                etag=f"{entry['hash']}-{encoding or 'identity'}",
+                max_age=ONE_YEAR,
+            )
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            if entry['encodings']:
+                response.vary.add('Accept-Encoding')
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+
+        if _HASHED_UPLOAD.match(filename):
+            response = send_from_directory(app.static_folder, filename, max_age=ONE_YEAR)
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+
+        #anything else: flask's normal handling (ETag + Last-Modified, 304 on revalidate)
+        return app.send_static_file(filename)
+
+    app.view_functions['static'] = static
+
+
+@click.command('build-assets')
+@click.option('--prune', is_flag=True, help="Also delete old hashed files (run once the old workers are gone).")
+@with_appcontext
+def build_assets_command(prune):
+    manifest = build_assets()
+    compressed = sum(1 for entry in manifest.values() if entry['encodings'])
+    click.echo(f"Fingerprinted {len(manifest)} static file(s), {compressed} precompressed"
+               + ("" if brotli is not None else " (gzip only, brotli isn't installed)") + ".")
+    if prune:
+        click.echo(f"Removed {prune_assets(manifest)} old file(s).")
@@ -3,7 +3,10 @@
 #Import necessary flask and library modules
 from flask import Blueprint, flash, render_template, request, url_for, redirect, session
 #Password hashing and verification (bcrypt = strong hashing algorithm)
-from flask_bcrypt import generate_password_hash, check_password_hash
+#runs in the bounded hashing pool, see passwords.py
+from .passwords import hash_password, check_password, needs_rehash
+#rate limits / in-flight cap on the POSTs, see admission.py
+from .admission import admit
 #Flask-login utilities to manage user session/login state
 from flask_login import login_user, login_required, logout_user
 #SQLAlchemy models (user table defined in models.py)
@@ -23,6 +26,7 @@ auth_bp = Blueprint('auth', __name__)
 # this is a hint for a login function
 #this route supports both form display (GET) and form submission (POST)
 @auth_bp.route('/login', methods=['GET', 'POST']) 
+@admit('login')
 # view function
 def login():
     #create an isntance of the loginform (from forms.py)
@@ -46,22 +50,24 @@ def login():
             error = 'Incorrect user name'
             
         #If user exists, check password hash against plain text password entered
-        elif not check_password_hash(user.password, password): # takes the hash and cleartext password
+        elif not check_password(user.password, password): # takes the hash and cleartext password
             error = 'Incorrect password'
+
+        #hash was made with an older bcrypt cost, upgrade it while we have the password
+        elif needs_rehash(user.password):
+            user.password = hash_password(password)
+            db.session.commit()
             
         #If no errors, log the user in
         if error is None:
             login_user(user) #Flask-login is going to set a session cookie so the user stays logged in
-            login_user(user)  
-
-            session['email'] = user.email  # store email in session
-            session['name'] = user.name # store the user name in the session
+            #(name/email used to be copied into the session here too, current_user has
+            #them now and they come from the user cache, see user_cache.py)
 
             #WILL NEED TO TEST IF THIS IS WORKING LATER
             #This is complicated
             #Check if the user was trying to access a protected page before login
             nextp = request.args.get('next') # this gives the url from where the login page was accessed
-            print(nextp) #For debugging
             #If no redirect target or it's unsafe, send user to homepage
             if not nextp or not nextp.startswith('/'):
                 return redirect(url_for('main.index')) #go to the homepage
@@ -76,6 +82,7 @@ def login():
 
 #NEW CODE ----------------------------------------------------------------------------------------------------------
 @auth_bp.route('/register', methods=['GET', 'POST']) #supports form display + submission
+@admit('register')
 
 def register():
     #Create an instance of the registerform
@@ -93,8 +100,8 @@ def register():
 
         #create new user object
         #hash the password securely using bcrypt
-        #decode converts hash btyes to string
-        hashed_password = generate_password_hash(register_form.password.data).decode('utf-8')
+        #(hash_password runs it in the hashing pool and hands back a string)
+        hashed_password = hash_password(register_form.password.data)
         #create new user object from form data
         new_user = User(
             name=register_form.user_name.data,
@@ -118,7 +125,7 @@ def register():
 @auth_bp.route('/logout')
 @login_required  #only allow logged-in users to log out from utils.py
 def logout():
-    #remove email and username from session so navbar updates
+    #remove email and username left in the session by older logins
     session.pop('email', None)
     session.pop('name', None)
     #log user out (Flask-Login)
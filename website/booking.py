@@ -0,0 +1,93 @@
+#commented
+
+#Booking engine
+#
+#The old book_event read tickets_left, checked it in python, and only THEN
+#inserted the booking. Two requests landing at the same time could both pass
+#the check and we'd sell more tickets than the pool holds (oversell).
+#
+#Here the capacity check and the seat reservation are ONE statement:
+#
+#   UPDATE event SET tickets_sold = tickets_sold + :qty
+#   WHERE id = :id AND tickets_sold + :qty <= capacity
+#
+#The database applies that atomically, so whoever gets there second either
+#sees the updated counter (and fails the WHERE) or waits for the first one:
+# - Postgres: the second UPDATE blocks on the row lock and then re-checks the
+#   WHERE against the committed row, same guarantee as SELECT ... FOR UPDATE
+#   but in one round trip.
+# - SQLite: the UPDATE is the first write in the transaction so it grabs the
+#   write lock right there (what BEGIN IMMEDIATE would do). If another worker
+#   holds it we get "database is locked" and just retry.
+#The booking row is inserted in the same transaction, so either both happen or neither.
+
+import random
+import time
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from . import db
+from .models import Event, Booking
+
+
+#Raised when a booking can't go through, the message is safe to flash to the user
+class BookingError(Exception):
+    pass
+
+
+#Reserve qty seats on an event for a user and insert the Booking
+#returns (booking, tickets_left) or raises BookingError
+def reserve_seats(event_id, user_id, qty, unit_price=0.0):
+    max_retries = current_app.config.get('BOOKING_MAX_RETRIES', 10)
+    attempt = 0
+    while True:
+        try:
+            return _try_reserve(event_id, user_id, qty, unit_price)
+        except OperationalError:
+            #lock conflict (sqlite "database is locked" / pg serialization etc)
+            db.session.rollback()
+            attempt += 1
+            if attempt > max_retries:
+                current_app.logger.warning("Booking for event %s gave up after %s retries", event_id, max_retries)
+                raise BookingError("The booking system is busy right now, please try again.")
+            #exponential backoff with jitter so the retries don't all collide again
+            time.sleep(min(0.5, 0.005 * (2 ** attempt)) * random.random())
+
+
+def _try_reserve(event_id, user_id, qty, unit_price):
+    #make sure the reserving UPDATE is the first statement of a fresh transaction
+    db.session.rollback()
+
+    row = db.session.execute(
+        db.update(Event)
+        .where(Event.id == event_id)
+        .where(Event.tickets_sold + qty <= Event.capacity)
+        .values(
+            tickets_sold=Event.tickets_sold + qty,
+            #selling the last seat is a real status transition, persist it here
+            stored_status=db.case(
+                (Event.tickets_sold + qty >= Event.capacity, 'Sold Out'),
+                else_=Event.stored_status
+            )
+        )
+        .returning(Event.capacity - Event.tickets_sold)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if row is None:
+        db.session.rollback()
+        left = db.session.scalar(db.select(Event.tickets_left).where(Event.id == event_id)) or 0
+        if left <= 0:
+            raise BookingError("This event is SOLD OUT. No more tickets available.")
+        raise BookingError(f"Not enough tickets available. Only {left} left.")
+
+    booking = Booking(
+        user_id=user_id,
+        event_id=event_id,
+        quantity=qty,
+        price=unit_price * qty if unit_price else 0.0
+    )
+    db.session.add(booking)
+    db.session.commit()
+    return booking, row[0]
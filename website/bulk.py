@@ -0,0 +1,437 @@
+#commented
+
+#Bulk import / export of users, events and bookings
+#
+#Onboarding a venue operator meant typing every event into create_event by hand, and
+#the only way to get bookings out for accounting was the my_bookings page. This
+#streams rows in and out as NDJSON (one JSON object per line) or CSV (header row):
+#   flask --app main export-data bookings --format csv -o bookings.csv
+#   flask --app main import-data events events.ndjson
+#   GET  /admin/export/<kind>?format=ndjson|csv
+#   POST /admin/import/<kind>?format=ndjson|csv      (request body = the file)
+#
+#Memory stays flat however big the file is:
+# - exports read through a server-side cursor (yield_per) and write ~64KB at a time,
+#   over http that's a streamed response so nothing is built up in memory
+# - imports parse one line at a time and insert BULK_BATCH_SIZE rows per INSERT
+#   (one executemany, plain rows, no ORM objects), committing after every batch
+#
+#An import stops at the first bad line/batch and says which line it was. Batches
+#before it are already committed (so a 1M row file doesn't hold one giant write lock).
+#ids in the file are kept, so bookings can point at imported events/users.
+#Counters (tickets_sold, comment_count) are worked out, not imported: they're
+#rebuilt once at the end, same as reconcile-tickets.
+#Rows are checked like the app would: event status has to be one the app uses (case
+#doesn't matter, it's stored as Open / Closed / Sold Out / Cancelled), bookings need a
+#quantity of at least 1 and can't take an event past its capacity.
+#
+#Users: the password hash is never exported. On import give either "password"
+#(plain text, hashed here) or "password_hash" (an existing bcrypt hash).
+#
+#The admin endpoints only exist when ADMIN_TOKEN is set, send it as
+#"Authorization: Bearer <token>" (same as /metrics).
+
+import contextlib
+import csv
+import hmac
+import io
+import json
+import sys
+import time
+from datetime import datetime
+
+import click
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from flask.cli import with_appcontext
+from sqlalchemy import func
+from sqlalchemy.exc import DBAPIError
+
+from . import db, page_cache, passwords
+from .models import User, Event, Booking
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+#kind -> (model, columns exported, columns accepted on import)
+KINDS = {
+    'users': (User, ('id', 'name', 'email'), ('id', 'name', 'email')),
+    'events': (
+        Event,
+        ('id', 'title', 'description', 'location', 'date', 'capacity', 'cost', 'status',
+         'features', 'image_file', 'created_by', 'waiting_room_rate', 'tickets_sold', 'comment_count',
+         'updated_at'),
+        ('id', 'title', 'description', 'location', 'date', 'capacity', 'cost', 'status',
+         'features', 'image_file', 'created_by', 'waiting_room_rate', 'updated_at'),
+    ),
+    'bookings': (
+        Booking,
+        ('id', 'user_id', 'event_id', 'quantity', 'price', 'date'),
+        ('id', 'user_id', 'event_id', 'quantity', 'price', 'date'),
+    ),
+}
+#have to be in every imported record
+REQUIRED = {
+    'users': ('name', 'email'),
+    'events': ('title', 'location', 'capacity'),
+    'bookings': ('user_id', 'event_id'),
+}
+#exported but skipped on import (rebuilt afterwards instead)
+DERIVED = {'tickets_sold', 'comment_count'}
+#the event statuses the app uses, imported ones are matched case-insensitively
+STATUSES = {status.lower(): status for status in ('Open', 'Closed', 'Sold Out', 'Cancelled')}
+FORMATS = ('ndjson', 'csv')
+#how much output is gathered before it's written / sent
+CHUNK_BYTES = 64 * 1024
+
+
+#Bad input, line is the line number in the file (header is line 1 for csv)
+class BulkError(Exception):
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _batch_size():
+    return current_app.config.get('BULK_BATCH_SIZE', 5000)
+
+
+#---------------------------------------------------------------------------------
+#EXPORT
+#---------------------------------------------------------------------------------
+
+#rows of one kind as dicts, oldest id first, fetched yield_per rows at a time
+def export_rows(kind):
+    model, fields, _ = KINDS[kind]
+    table = model.__table__
+    stmt = (
+        db.select(*[table.c[name] for name in fields])
+        .order_by(table.c.id)
+        .execution_options(yield_per=_batch_size())
+    )
+    for row in db.session.execute(stmt):
+        yield dict(zip(fields, row))
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"can't export {type(value).__name__}")
+
+
+#one encoder for the whole export (json.dumps with options builds a new one per call)
+_encoder = json.JSONEncoder(default=_json_value, separators=(',', ':'))
+
+
+#glue small strings together into ~CHUNK_BYTES pieces (fewer writes / http chunks)
+def _chunks(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        yield _encoder.encode(row) + '\n'
+
+
+def _csv_lines(rows, fields):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([v.isoformat() if isinstance(v, datetime) else v for v in row.values()])
+        if out.tell() >= CHUNK_BYTES:
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    yield out.getvalue()
+
+
+#the whole export as text chunks, for a file or a streamed response
+def export_chunks(kind, fmt, rows=None):
+    rows = export_rows(kind) if rows is None else rows
+    lines = _csv_lines(rows, KINDS[kind][1]) if fmt == 'csv' else _ndjson_lines(rows)
+    return _chunks(lines)
+
+
+#---------------------------------------------------------------------------------
+#IMPORT
+#---------------------------------------------------------------------------------
+
+#(line number, dict) for every record in an NDJSON text stream
+def _read_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise BulkError(number, "not valid JSON")
+        if not isinstance(record, dict):
+            raise BulkError(number, "expected a JSON object")
+        yield number, record
+
+
+#same for CSV, empty cells mean "not given"
+def _read_csv(lines):
+    reader = csv.DictReader(lines)
+    for record in reader:
+        if None in record:
+            raise BulkError(reader.line_num, "more cells than header columns")
+        yield reader.line_num, {k: v for k, v in record.items() if v != ''}
+
+
+#turn a value from the file into what the column wants (kind = its python type)
+def _convert(kind, value):
+    if value is None:
+        return None
+    if kind is datetime:
+        return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    if kind is int:
+        if isinstance(value, bool) or isinstance(value, float):
+            raise ValueError(f"{value!r} is not a whole number")
+        return int(value)
+    if kind is float:
+        if isinstance(value, bool):
+            raise ValueError(f"{value!r} is not a number")
+        return float(value)
+    return str(value)
+
+
+#field name -> python type of its column, for the fields a kind accepts on import
+def _field_types(kind):
+    model, _, allowed = KINDS[kind]
+    return {name: model.__table__.c[name].type.python_type for name in allowed}
+
+
+#check/convert one record into a row for the INSERT
+def _clean(kind, types, number, record):
+    row = {}
+    for name, value in record.items():
+        kind_of = types.get(name)
+        if kind_of is None:
+            if name in DERIVED or (kind == 'users' and name in ('password', 'password_hash')):
+                continue
+            raise BulkError(number, f"unknown field {name!r}")
+        try:
+            row[name] = _convert(kind_of, value)
+        except (TypeError, ValueError) as e:
+            raise BulkError(number, f"bad value for {name}: {e}")
+    for name in REQUIRED[kind]:
+        if row.get(name) is None:
+            raise BulkError(number, f"{name} is required")
+
+    if kind == 'events' and row.get('status') is not None:
+        status = STATUSES.get(row['status'].strip().lower())
+        if status is None:
+            raise BulkError(number, f"bad value for status: {row['status']!r}, "
+                                    f"expected one of {', '.join(STATUSES.values())}")
+        row['status'] = status
+    if kind == 'bookings':
+        if row.get('quantity') is None:
+            row['quantity'] = 1  #same default as the model
+        elif row['quantity'] < 1:
+            raise BulkError(number, "quantity must be at least 1")
+
+    if kind == 'users':
+        if record.get('password_hash'):
+            row['password'] = record['password_hash']
+        elif record.get('password'):
+            row['password'] = passwords.hash_password(str(record['password']))
+        else:
+            raise BulkError(number, "users need a password or password_hash")
+    return row
+
+
+#INSERT one batch. Rows that leave out different optional columns can't share one
+#executemany (it compiles from the first row's keys), so they're grouped by key set
+def _insert_batch(table, batch):
+    groups = {}
+    for number, row in batch:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    try:
+        for rows in groups.values():
+            db.session.execute(db.insert(table), rows)
+        db.session.commit()
+    except DBAPIError as e:  # constraint errors etc, report the whole batch
+        db.session.rollback()
+        first, last = batch[0][0], batch[-1][0]
+        raise BulkError(first if first == last else f"{first}-{last}", str(e.orig))
+
+
+#Bookings can't sell more tickets than an event has: what's booked already (earlier
+#batches included) plus this batch, checked per event with one query per batch
+def _check_capacity(batch):
+    wanted = {}
+    for number, row in batch:
+        wanted.setdefault(row['event_id'], []).append((number, row['quantity']))
+    booked = (
+        db.select(func.coalesce(func.sum(Booking.quantity), 0))
+        .where(Booking.event_id == Event.id)
+        .scalar_subquery()
+    )
+    stmt = db.select(Event.id, Event.capacity, booked).where(Event.id.in_(list(wanted)))
+    events = {event_id: (capacity, sold) for event_id, capacity, sold in db.session.execute(stmt)}
+    for event_id, rows in wanted.items():
+        if event_id not in events:
+            raise BulkError(rows[0][0], f"no event with id {event_id}")
+        capacity, sold = events[event_id]
+        for number, quantity in rows:
+            sold += quantity
+            if sold > capacity:
+                raise BulkError(number, f"event {event_id} only has {capacity} tickets, "
+                                        f"this booking would make it {sold}")
+
+
+#postgres: ids came from the file, so move the sequence past them
+def _fix_sequence(table):
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM \"{table.name}\"), 1))"
+        ))
+        db.session.commit()
+
+
+#Import records from a text stream (file / request body), returns rows imported
+def import_stream(kind, stream, fmt):
+    model = KINDS[kind][0]
+    table = model.__table__
+    records = _read_csv(stream) if fmt == 'csv' else _read_ndjson(stream)
+    types = _field_types(kind)
+    size = _batch_size()
+    batch, total = [], 0
+
+    def flush():
+        if kind == 'bookings':
+            _check_capacity(batch)
+        _insert_batch(table, batch)
+        return len(batch)
+
+    for number, record in records:
+        batch.append((number, _clean(kind, types, number, record)))
+        if len(batch) >= size:
+            total += flush()
+            batch = []
+    if batch:
+        total += flush()
+    _finish_import(kind, table)
+    return total
+
+
+def _finish_import(kind, table):
+    from .commands import rebuild_ticket_counters, rebuild_comment_counters
+    _fix_sequence(table)
+    if kind in ('events', 'bookings'):
+        rebuild_ticket_counters()
+    if kind == 'events':
+        rebuild_comment_counters()
+    #core INSERTs don't fire the Event mapper events, so drop cached pages by hand
+    page_cache.invalidate_events()
+
+
+#---------------------------------------------------------------------------------
+#CLI
+#---------------------------------------------------------------------------------
+
+#open a file for the csv module (newline=''), "-" means stdin/stdout
+def _open(path, mode):
+    if path == '-':
+        std = sys.stdout if 'w' in mode else sys.stdin
+        return contextlib.nullcontext(io.TextIOWrapper(std.buffer, encoding='utf-8', newline='', write_through=True))
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+@click.command('export-data')
+@click.argument('kind', type=click.Choice(list(KINDS)))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='ndjson')
+@click.option('-o', '--output', type=click.Path(dir_okay=False, allow_dash=True), default='-',
+              help="file to write (default: stdout)")
+@with_appcontext
+def export_data_command(kind, fmt, output):
+    start = time.perf_counter()
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in export_rows(kind):
+            count += 1
+            yield row
+
+    with _open(output, 'w') as out:
+        for chunk in export_chunks(kind, fmt, counted()):
+            out.write(chunk)
+    elapsed = time.perf_counter() - start
+    #stderr, so it doesn't end up in the data when writing to stdout
+    click.echo(f"Exported {count} {kind} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s).", err=True)
+
+
+@click.command('import-data')
+@click.argument('kind', type=click.Choice(list(KINDS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default=None,
+              help="default: from the file extension, else ndjson")
+@with_appcontext
+def import_data_command(kind, path, fmt):
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'ndjson')
+    start = time.perf_counter()
+    with _open(path, 'r') as stream:
+        try:
+            count = import_stream(kind, stream, fmt)
+        except BulkError as e:
+            raise click.ClickException(str(e))
+    elapsed = time.perf_counter() - start
+    click.echo(f"Imported {count} {kind} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s).")
+
+
+#---------------------------------------------------------------------------------
+#ADMIN ENDPOINTS
+#---------------------------------------------------------------------------------
+
+@admin_bp.before_request
+def check_token():
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify(error="Not found"), 404
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                               f"Bearer {token}".encode('utf-8')):
+        return jsonify(error="Forbidden"), 403
+
+
+def _format():
+    fmt = request.args.get('format', 'ndjson')
+    return fmt if fmt in FORMATS else None
+
+
+@admin_bp.route('/export/<kind>')
+def export_data(kind):
+    fmt = _format()
+    if kind not in KINDS or fmt is None:
+        return jsonify(error="Unknown kind or format"), 404
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(export_chunks(kind, fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
+
+
+@admin_bp.route('/import/<kind>', methods=['POST'])
+def import_data(kind):
+    fmt = _format()
+    if kind not in KINDS or fmt is None:
+        return jsonify(error="Unknown kind or format"), 404
+    #MAX_CONTENT_LENGTH is sized for image uploads, imports get their own limit
+    request.max_content_length = current_app.config.get('BULK_IMPORT_MAX_BYTES')
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        count = import_stream(kind, stream, fmt)
+    except BulkError as e:
+        return jsonify(error=str(e), line=e.line), 400
+    except UnicodeDecodeError:
+        return jsonify(error="The file has to be UTF-8"), 400
+    return jsonify(imported=count, kind=kind)
@@ -0,0 +1,139 @@
+#commented
+
+#Flask CLI commands for looking after the database
+#These get registered in create_app() so they run with:
+#   flask --app main reconcile-tickets
+#(the app context is pushed for us by with_appcontext)
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func
+
+from . import db
+from .models import Event, Booking, Comment
+from .status_worker import check_statuses_command, refresh_statuses_command
+from .search import build_search_index_command
+from .migrations import db_upgrade_command
+from .images import build_image_variants_command
+from .assets import build_assets_command
+from .bulk import export_data_command, import_data_command
+
+
+#Rebuilds Event.tickets_sold from the bookings table
+#tickets_sold is normally kept up to date when a booking is inserted, but if
+#someone edits the db by hand (or an old db never had the counter) this fixes it.
+#It's one set-based UPDATE with a correlated subquery so we never load every
+#event into python. Returns how many events were fixed.
+def rebuild_ticket_counters():
+    booked = (
+        db.select(func.coalesce(func.sum(Booking.quantity), 0))
+        .where(Booking.event_id == Event.id)
+        .scalar_subquery()
+    )
+    #only touch rows where the counter is actually wrong
+    result = db.session.execute(
+        db.update(Event)
+        .where(Event.tickets_sold.is_distinct_from(booked))
+        .values(tickets_sold=booked)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+#Same thing for Event.comment_count from the comments table
+def rebuild_comment_counters():
+    posted = (
+        db.select(func.count(Comment.id))
+        .where(Comment.event_id == Event.id)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        db.update(Event)
+        .where(Event.comment_count.is_distinct_from(posted))
+        .values(comment_count=posted)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command('reconcile-tickets')
+@with_appcontext
+def reconcile_tickets():
+    updated = rebuild_ticket_counters()
+    click.echo(f"Reconciled ticket counters: {updated} event(s) updated.")
+    updated = rebuild_comment_counters()
+    click.echo(f"Reconciled comment counters: {updated} event(s) updated.")
+
+
+#The main query behind each hot route, run against the real db so we can look
+#at how the database plans to execute them (see check-query-plans below)
+def _route_queries():
+    from . import queries, search
+    from .models import User
+    return [
+        ('main.index', lambda: queries.first_events(5)),
+        ('events.list_events / events.home', lambda: queries.upcoming_events()),
+        ('events.list_events ?after=', lambda: queries.upcoming_events(after='2000-01-01T00:00:00_1')),
+        ('events.home ?q=', lambda: search.search_events('pool')),
+        ('events.my_bookings', lambda: queries.user_bookings(1)),
+        ('events.view_event comments', lambda: queries.event_comments(1)),
+        ('events.event_comments ?after=', lambda: queries.event_comments(1, after='2100-01-01T00:00:00_1')),
+        ('auth.login', lambda: db.session.scalar(db.select(User).where(User.name == 'someone'))),
+    ]
+
+
+#EXPLAIN every route's main query and fail if any of them falls back to a full
+#table scan (i.e. we're missing an index). Exits with status 1 on a full scan so
+#it can be run in CI straight after `flask db-upgrade`.
+#SQLite only for now -> "SCAN <table>" without "USING ... INDEX" is a full scan.
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    if db.engine.dialect.name != 'sqlite':
+        click.echo("check-query-plans only knows how to read SQLite query plans, skipping.")
+        return
+
+    failures = 0
+    for route, run in _route_queries():
+        captured = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                captured.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            run()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        for statement, parameters in captured:
+            plan = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            details = [row[-1] for row in plan]
+            #(scanning sqlite_master is just search.py checking the index exists)
+            scans = [d for d in details if d.startswith('SCAN') and 'INDEX' not in d and 'sqlite_' not in d]
+            status = 'FULL SCAN' if scans else 'ok'
+            failures += bool(scans)
+            click.echo(f"[{status:>9}] {route}: {'; '.join(details)}")
+
+    if failures:
+        click.echo(f"{failures} query/queries fall back to a full table scan.")
+        raise SystemExit(1)
+    click.echo("All route queries use an index.")
+
+
+#every CLI command we register, create_app() loops over this
+ALL_COMMANDS = [
+    reconcile_tickets,
+    refresh_statuses_command,
+    check_statuses_command,
+    build_search_index_command,
+    db_upgrade_command,
+    check_query_plans,
+    build_image_variants_command,
+    build_assets_command,
+    export_data_command,
+    import_data_command,
+]
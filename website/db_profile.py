@@ -0,0 +1,106 @@
+#commented
+
+#Database engine profile
+#
+#create_app used to set just the database URI and leave every engine option at
+#SQLAlchemy's defaults. With a few workers on sitedata.sqlite that meant
+#"database is locked" errors (readers and the writer fighting over the rollback
+#journal) and slow commits (a full fsync every time).
+#
+#DB_PROFILE picks the settings:
+# - production (default) -> the tuned settings below
+# - default              -> SQLAlchemy's stock behaviour, nothing changed
+#
+#SQLite (set on every new connection with PRAGMAs from a connect event):
+#   journal_mode=WAL        readers no longer block on a writer (or a writer on readers)
+#   synchronous=NORMAL      safe with WAL, fsyncs at checkpoints instead of every commit
+#   busy_timeout=5000       wait up to 5s for a lock instead of failing straight away
+#   mmap_size=256MB         reads come straight from the OS page cache
+#Postgres/MySQL (passed to create_engine):
+#   pool_size=10, max_overflow=20, pool_timeout=30, pool_recycle=1800, pool_pre_ping
+#
+#Each value can be overridden with its own env var, see PROFILE_ENV below.
+
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+#env var -> default used by the production profile
+PROFILE_ENV = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT_MS': '5000',
+    'SQLITE_MMAP_SIZE': str(256 * 1024 * 1024),
+    'DB_POOL_SIZE': '10',
+    'DB_MAX_OVERFLOW': '20',
+    'DB_POOL_TIMEOUT': '30',
+    'DB_POOL_RECYCLE': '1800',
+    'DB_POOL_PRE_PING': '1',
+}
+
+
+def _setting(name):
+    return os.environ.get(name, PROFILE_ENV[name])
+
+
+def _is_sqlite(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+#the SQLALCHEMY_ENGINE_OPTIONS for a database uri
+def engine_options(uri, profile='production'):
+    if profile != 'production':
+        return {}
+    if _is_sqlite(uri):
+        #the driver's own lock wait, same length as busy_timeout
+        return {'connect_args': {'timeout': int(_setting('SQLITE_BUSY_TIMEOUT_MS')) / 1000}}
+    return {
+        'pool_size': int(_setting('DB_POOL_SIZE')),
+        'max_overflow': int(_setting('DB_MAX_OVERFLOW')),
+        'pool_timeout': int(_setting('DB_POOL_TIMEOUT')),
+        'pool_recycle': int(_setting('DB_POOL_RECYCLE')),
+        'pool_pre_ping': _setting('DB_POOL_PRE_PING') == '1',
+    }
+
+
+#the PRAGMAs run on every new sqlite connection
+def sqlite_pragmas(in_memory=False):
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(_setting('SQLITE_BUSY_TIMEOUT_MS'))}",
+        f"PRAGMA synchronous = {_setting('SQLITE_SYNCHRONOUS')}",
+    ]
+    #WAL and mmap mean nothing for an in-memory db
+    if not in_memory:
+        pragmas.insert(0, f"PRAGMA journal_mode = {_setting('SQLITE_JOURNAL_MODE')}")
+        pragmas.append(f"PRAGMA mmap_size = {int(_setting('SQLITE_MMAP_SIZE'))}")
+    return pragmas
+
+
+#add the pragma connect hook to a sqlite engine (does nothing for other databases)
+def tune_engine(engine, profile='production'):
+    if profile != 'production' or engine.dialect.name != 'sqlite':
+        return
+    database = engine.url.database
+    pragmas = sqlite_pragmas(in_memory=not database or database == ':memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+#fill in SQLALCHEMY_ENGINE_OPTIONS before db.init_app(app)
+def configure(app):
+    profile = app.config.setdefault('DB_PROFILE', os.environ.get('DB_PROFILE', 'production'))
+    options = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], profile)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {}).update(options)
+
+
+#hook the pragmas onto every engine, call after db.init_app(app)
+def init_app(app, db):
+    with app.app_context():
+        for engine in db.engines.values():
+            tune_engine(engine, app.config['DB_PROFILE'])
@@ -1,16 +1,23 @@
 #commented
 
 #import the necessary modules and functions from Flask and Flask-Login
-from flask import Blueprint, render_template, redirect, request, url_for, flash
+from flask import Blueprint, render_template, redirect, request, url_for, flash, make_response, jsonify
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
-import os
-from sqlalchemy import or_, func
 from datetime import datetime
 from flask import current_app
 from . import db  #import the database instance from init.py
 
 from .models import Event, Comment, Booking
+from . import queries
+from . import search
+from . import images
+from .booking import reserve_seats, BookingError
+from .fragment_cache import invalidate_event
+from .replicas import replica_reads
+from .page_cache import cached_page
+from .admission import admit, limited
+from . import waiting_room
+from . import live
 from .forms import EventForm, CommentForm, BookingForm, CancelForm
 
 events_bp = Blueprint('events', __name__)
@@ -22,10 +29,13 @@ def create_event():
     if form.validate_on_submit():
         filename = None
         if form.image.data:
-            filename = secure_filename(form.image.data.filename)
-            # consider prepending a UUID or timestamp to avoid collisions
-            filepath = os.path.join(current_app.root_path, 'static/uploads', filename)
-            form.image.data.save(filepath)
+            # saved under a content-hash name (no collisions), resized variants
+            # get made in the background (see images.py)
+            try:
+                filename = images.save_upload(form.image.data)
+            except images.UploadError as e:
+                flash(str(e), 'danger')
+                return render_template('create_event.html', form=form)
 
         new_event = Event(
             title=form.title.data,
@@ -35,6 +45,7 @@ def create_event():
             cost=form.cost.data,
             capacity=form.capacity.data,
             features=form.features.data,
+            waiting_room_rate=form.waiting_room_rate.data,
             date=datetime.combine(form.date.data, datetime.min.time()) if form.date.data else None,
             created_by=current_user.id,
             image_file=filename
@@ -43,23 +54,24 @@ def create_event():
         db.session.commit()
         flash('Event created successfully!', 'success')
         return redirect(url_for('events.list_events'))
-    else:
-        print(form.errors)
+    elif form.errors:
+        current_app.logger.debug("create_event form errors: %s", form.errors)
     return render_template('create_event.html', form=form)
 
 
+#browsing pages read from a replica when there is one (GETs only, see replicas.py)
+#and anonymous visitors get them from the full-page cache (page_cache.py)
 @events_bp.route('/list')
+@replica_reads
+@cached_page()
 def list_events():
-    # Only show events whose date is today or in the future
-    events = (
-        Event.query
-        .filter(Event.date >= datetime.now())  # exclude past events
-        .order_by(Event.date.asc())            # sort upcoming events by soonest first
-        .all()
-    )
-    return render_template('list_events.html', events=events)
+    # Only show events whose date is today or in the future, soonest first
+    # (creator is eager-loaded so the "by <name>" line doesn't query per card)
+    events, next_cursor = queries.upcoming_events(after=request.args.get('after'))
+    return render_template('list_events.html', events=events, next_cursor=next_cursor)
 
 @events_bp.route('/<int:event_id>', methods=['GET', 'POST'])
+@replica_reads
 def view_event(event_id):
     event = Event.query.get_or_404(event_id)
 
@@ -76,47 +88,43 @@ def view_event(event_id):
             except Exception:
                 current_app.logger.debug("Could not set event.is_cancelled; continuing with status only.")
         db.session.commit()
+        invalidate_event(event.id)  # drop the cached cards showing the old status
         return redirect(url_for('events.view_event', event_id=event.id))
 
-    total_booked = db.session.scalar(
-        db.select(func.coalesce(func.sum(Booking.quantity), 0)).where(Booking.event_id == event.id)
-    ) or 0
-    tickets_left = event.capacity - total_booked
+    # tickets_sold is kept on the event row, so no SUM over bookings here
+    tickets_left = event.tickets_left
 
-    now = datetime.utcnow()
-
-    if hasattr(event, 'is_cancelled'):
-        is_cancelled_flag = bool(getattr(event, 'is_cancelled', False))
-    else:
-        is_cancelled_flag = str(getattr(event, 'status', '')).lower() == 'cancelled'
-
-    if is_cancelled_flag:
-        event.status = "Cancelled"
-    elif event.date and event.date < now:
-        event.status = "Closed"
-    elif tickets_left <= 0:
-        event.status = "Sold Out"
-    else:
-        event.status = "Open"
-
-    db.session.commit()
+    # event.status is worked out when it's read (see models.Event.status), so
+    # a GET of this page no longer writes anything to the database
 
     if comment_form.validate_on_submit() and comment_form.submit.data:
         if current_user.is_authenticated:
-            new_comment = Comment(
-                text=comment_form.text.data,
-                user_id=current_user.id,
-                event_id=event.id
-            )
-            db.session.add(new_comment)
-            db.session.commit()
+            #only the comment POST is rate limited here, not the cancel above
+            with limited('comment'):
+                new_comment = Comment(
+                    text=comment_form.text.data,
+                    user_id=current_user.id,
+                    event_id=event.id
+                )
+                db.session.add(new_comment)
+                #keep the count on the event row in step, same transaction as the insert
+                db.session.execute(
+                    db.update(Event)
+                    .where(Event.id == event.id)
+                    .values(comment_count=Event.comment_count + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            invalidate_event(event.id)  # cards show the comment count
             flash("Your comment has been posted!", "success")
             return redirect(url_for('events.view_event', event_id=event.id))
         else:
             flash("You must be logged in to comment.", "danger")
             return redirect(url_for('auth.login'))
 
-    comments = Comment.query.filter_by(event_id=event.id).order_by(Comment.date_created.desc()).all()
+    # only the newest page of comments is in the page, the rest load from
+    # event_comments below when "Load more" is clicked
+    comments, next_comments = queries.event_comments(event.id)
 
     return render_template(
         'view_event.html',
@@ -125,35 +133,56 @@ def view_event(event_id):
         booking_form=booking_form,
         cancel_form=cancel_form,
         comments=comments,
-        tickets_left=tickets_left
+        next_comments=next_comments,
+        tickets_left=tickets_left,
+        #None unless the event has a waiting room and this user has a place in it
+        queue=waiting_room.status(event.id) if waiting_room.enabled(event) else None
     )
 
+# Older comments for view_event, one page at a time (html fragment for the
+# "Load more comments" button, the next cursor comes back in X-Next-Cursor)
+@events_bp.route('/<int:event_id>/comments')
+@replica_reads
+def event_comments(event_id):
+    comments, next_cursor = queries.event_comments(event_id, after=request.args.get('after'))
+    response = make_response(render_template('_comment_items.html', comments=comments))
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+# Live tickets left / status for view_event as Server-Sent Events (see live.py)
+@events_bp.route('/<int:event_id>/live')
+def event_live(event_id):
+    event = Event.query.get_or_404(event_id)
+    response = live.stream(event)
+    if response is None:
+        return "Too many live connections right now\n", 503, {'Retry-After': '30', 'Content-Type': 'text/plain'}
+    return response
+
 @events_bp.route('/home')
+@replica_reads
+@cached_page()
 def home():
     query = request.args.get('q', '').strip()
-    base_query = Event.query.order_by(Event.date.asc())
+
+    has_more = False
+    next_cursor = None
+    page = request.args.get('page', 1, type=int)
 
     if query:
-        search = f"%{query}%"
-        events = base_query.filter(
-            or_(
-                Event.features.ilike(search),
-                Event.title.ilike(search),
-                Event.description.ilike(search),
-                Event.location.ilike(search)
-            )
-        ).all()
-        print(f"[DEBUG] Searching for '{query}' → Found {len(events)} events")
-        for e in events:
-            print(f"Matched: {e.title} ({e.features})")
+        # ranked full-text search (search.py), falls back to ILIKE on old dbs
+        events, has_more = search.search_events(query, page=page, per_page=current_app.config['SEARCH_PAGE_SIZE'])
+        current_app.logger.debug("Search for %r found %d event(s) on page %d", query, len(events), page)
     else:
         # Show upcoming events; relies on Event.date being a datetime
-        events = base_query.filter(Event.date >= datetime.utcnow()).order_by(Event.date.asc()).all()
+        events, next_cursor = queries.upcoming_events(after=request.args.get('after'))
 
-    return render_template('home.html', events=events, search_term=query)
+    return render_template('home.html', events=events, search_term=query, page=page, has_more=has_more,
+                           next_cursor=next_cursor)
 
 @events_bp.route('/<int:event_id>/book', methods=['GET', 'POST'])
 @login_required
+@admit('booking')
 def book_event(event_id):
     event = Event.query.get_or_404(event_id)
     form = BookingForm()
@@ -166,31 +195,35 @@ def book_event(event_id):
         flash(f"This event is currently {event.status} and cannot be booked.", "danger")
         return redirect(url_for('events.view_event', event_id=event.id))
 
-    total_booked = db.session.scalar(
-        db.select(func.coalesce(func.sum(Booking.quantity), 0)).where(Booking.event_id == event.id)
-    ) or 0
-    tickets_left = event.capacity - total_booked
+    tickets_left = event.tickets_left
 
     if tickets_left <= 0:
         flash("This event is SOLD OUT. No more tickets available.", "danger")
         return redirect(url_for('events.view_event', event_id=event.id))
 
+    # waiting room events: only people whose turn it is get to book
+    if not waiting_room.admitted(event):
+        flash("This on-sale has a waiting room, you'll get to book when it's your turn.", "info")
+        return redirect(url_for('events.join_queue', event_id=event.id))
+
     if form.validate_on_submit():
         qty = form.quantity.data
-        if qty > tickets_left:
-            flash(f"Not enough tickets available. Only {tickets_left} left.", "danger")
-            return redirect(url_for('events.view_event', event_id=event.id))
 
-        total_price = event.cost * qty if event.cost else 0.0
-        new_booking = Booking(
-            user_id=current_user.id,
-            event_id=event.id,
-            quantity=qty,
-            price=total_price
-        )
-        db.session.add(new_booking)
-        db.session.commit()
+        # use up their place in the queue first, so the same place can't book twice
+        if not waiting_room.claim(event):
+            flash("This on-sale has a waiting room, you'll get to book when it's your turn.", "info")
+            return redirect(url_for('events.join_queue', event_id=event.id))
+
+        # the real capacity check happens inside reserve_seats as one atomic
+        # UPDATE, the check above is just a cheap early exit for sold out events
+        try:
+            new_booking, tickets_left = reserve_seats(event.id, current_user.id, qty, event.cost)
+        except BookingError as e:
+            waiting_room.unclaim(event)  # nothing booked, they keep their place
+            flash(str(e), "danger")
+            return redirect(url_for('events.view_event', event_id=event.id))
 
+        invalidate_event(event.id)  # tickets left / status on the cards changed
         flash(f"Booking successful! Order ID: {new_booking.id}", "success")
 
 
@@ -199,11 +232,35 @@ def book_event(event_id):
             event=event,
             booking=new_booking,
             user=current_user,
-            tickets_left=tickets_left - qty
+            tickets_left=tickets_left
         )
 
     return render_template('book_event.html', event=event, form=form)
 
+# Waiting room: join the queue (or see where you are in it)
+# the page polls queue_status below and goes back to the event once it's your turn
+@events_bp.route('/<int:event_id>/queue')
+@login_required
+def join_queue(event_id):
+    event = Event.query.get_or_404(event_id)
+    if not waiting_room.enabled(event) or event.status.lower() != 'open':
+        return redirect(url_for('events.view_event', event_id=event.id))
+    waiting_room.join(event)
+    queue = waiting_room.status(event.id)
+    if queue['admitted']:
+        return redirect(url_for('events.view_event', event_id=event.id))
+    return render_template('waiting_room.html', event=event, queue=queue,
+                           poll_seconds=current_app.config.get('WAITING_ROOM_POLL', 5))
+
+# Where you are in the queue, answered from the waiting room backend (no database)
+@events_bp.route('/<int:event_id>/queue/status')
+@login_required
+def queue_status(event_id):
+    queue = waiting_room.status(event_id)
+    if queue is None:
+        return jsonify(queued=False, join=url_for('events.join_queue', event_id=event_id)), 404
+    return jsonify(queued=True, **queue)
+
 @events_bp.route('/<int:event_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_event(event_id):
@@ -223,14 +280,17 @@ def edit_event(event_id):
         form.cost.data = event.cost
         form.capacity.data = event.capacity
         form.features.data = event.features
+        form.waiting_room_rate.data = event.waiting_room_rate
         form.date.data = event.date.date() if event.date else None
 
     if form.validate_on_submit():
         filename = event.image_file
         if form.image.data:
-            filename = secure_filename(form.image.data.filename)
-            filepath = os.path.join(current_app.root_path, 'static/uploads', filename)
-            form.image.data.save(filepath)
+            try:
+                filename = images.save_upload(form.image.data)
+            except images.UploadError as e:
+                flash(str(e), 'danger')
+                return render_template('edit_event.html', form=form, cancel_form=cancel_form, editing=True, event=event)
 
         event.title = form.title.data
         event.description = form.description.data
@@ -238,10 +298,14 @@ def edit_event(event_id):
         event.cost = form.cost.data
         event.capacity = form.capacity.data
         event.features = form.features.data
+        event.waiting_room_rate = form.waiting_room_rate.data
         event.date = datetime.combine(form.date.data, datetime.min.time()) if form.date.data else None
         event.image_file = filename
 
+        # a new date or capacity can close/reopen the event, persist that transition
+        event.sync_status()
         db.session.commit()
+        invalidate_event(event.id)  # cached cards still show the old details
 
         flash('Event updated successfully!', 'success')
         return redirect(url_for('events.view_event', event_id=event.id))
@@ -251,17 +315,23 @@ def edit_event(event_id):
 @events_bp.route('/my_bookings')
 @login_required
 def my_bookings():
-    bookings = Booking.query.filter_by(user_id=current_user.id).order_by(Booking.date.desc()).all()
-    return render_template('my_bookings.html', bookings=bookings)
+    bookings, next_cursor = queries.user_bookings(current_user.id, after=request.args.get('after'))
+    return render_template('my_bookings.html', bookings=bookings, next_cursor=next_cursor)
 
 @events_bp.route('/FAQ')
+@replica_reads
+@cached_page(ttl=3600, events=False)
 def FAQ():
     return render_template('FAQ.html')
 
 @events_bp.route('/contact')
+@replica_reads
+@cached_page(ttl=3600, events=False)
 def contact():
     return render_template('contact.html')
 
 @events_bp.route('/TnC')
+@replica_reads
+@cached_page(ttl=3600, events=False)
 def TnC():
     return render_template('TnC.html')
\ No newline at end of file
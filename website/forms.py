@@ -5,7 +5,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileAllowed
 from wtforms.fields import TextAreaField, SubmitField, StringField, PasswordField, DateField, TimeField, IntegerField, DecimalField, SelectField
-from wtforms.validators import InputRequired, Length, Email, EqualTo, DataRequired, NumberRange, Regexp
+from wtforms.validators import InputRequired, Length, Email, EqualTo, DataRequired, NumberRange, Regexp, Optional
 
 
 # ---------------Uni provided code for login and registration----------------------------------
@@ -55,6 +55,11 @@ class EventForm(FlaskForm):
     #Status of the event (NOTE should be Open, Inactive, Closed, Cancelled)
     # status = SelectField('Event Status', choices=[('open', 'Open'), ('inactive', 'Inactive'), ('closed', 'Closed'), ('cancelled', 'Cancelled')], validators=[DataRequired()], default='open')
 
+    #Waiting room for big on-sales: how many people get to the booking form per minute
+    #left empty = no queue, everyone books straight away (see waiting_room.py)
+    waiting_room_rate = IntegerField('Waiting room (bookings per minute, empty = off)',
+                                     validators=[Optional(), NumberRange(min=1, message="Must be at least 1 per minute")])
+
     #Date of the event (required, must match the format given) - could make this easier
     date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
     
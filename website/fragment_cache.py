@@ -0,0 +1,183 @@
+#commented
+
+#Rendered-fragment cache for event cards
+#
+#The same event card gets rendered on /, /home, /list and /my_bookings for every
+#single request, and each time Jinja has to redo the status badge logic, the
+#strftime calls and the url_for calls. The card only actually changes when the
+#event does, so we render it once and keep the html.
+#
+#Templates call  {{ cached_card('_event_card.html', event) }}  instead of
+#writing the card inline. The cache key is:
+#   card template + event id + event.updated_at + event.status (+ booking id)
+#   + whether the image variants are ready yet
+# - updated_at is bumped on every write to the event row (edits, bookings,
+#   cancellations, status refreshes), so a changed event never hits an old entry
+# - status is in there because Closed is worked out from the clock, not a write
+#On top of that events.py calls invalidate_event() after edits/bookings/cancels so
+#the old entries are dropped straight away instead of waiting to be evicted.
+#
+#Backends:
+# - LRUBackend    -> in-process, default (CARD_CACHE_SIZE entries per worker)
+# - SharedBackend -> wraps any redis-style client (get / set(ex=) / incr) so
+#                    all workers share one cache. Set app.config['CARD_CACHE_CLIENT']
+# - CARD_CACHE_BACKEND=none turns caching off
+#
+#Hits/misses are counted globally (stats()) and per request (X-Card-Cache header
+#next to X-Query-Count).
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context, render_template
+from markupsafe import Markup
+
+from . import images, live, page_cache
+
+
+#In-process LRU, one per worker process
+class LRUBackend:
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        #event id -> keys cached for it, so invalidate_event() doesn't scan everything
+        self._by_event = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, event_id):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, event_id):
+        with self._lock:
+            self._data[key] = (value, event_id)
+            self._data.move_to_end(key)
+            self._by_event.setdefault(event_id, set()).add(key)
+            while len(self._data) > self.max_entries:
+                old_key, (_, old_event) = self._data.popitem(last=False)
+                keys = self._by_event.get(old_event)
+                if keys:
+                    keys.discard(old_key)
+                    if not keys:
+                        del self._by_event[old_event]
+
+    def delete_event(self, event_id):
+        with self._lock:
+            for key in self._by_event.pop(event_id, ()):
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._by_event.clear()
+
+
+#Shared backend on top of a redis-style client
+#Every worker reads/writes the same store. Invalidation works through a per-event
+#generation number that's part of the key: bumping it orphans every old entry for
+#that event at once (they expire on their own after `ttl` seconds).
+class SharedBackend:
+    def __init__(self, client, prefix='card:', ttl=3600):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _generation(self, event_id):
+        return self.client.get(f"{self.prefix}gen:{event_id}") or b'0'
+
+    def _key(self, key, event_id):
+        generation = self._generation(event_id)
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        return f"{self.prefix}{generation}:{key}"
+
+    def get(self, key, event_id):
+        value = self.client.get(self._key(key, event_id))
+        if value is None:
+            return None
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, event_id):
+        self.client.set(self._key(key, event_id), str(value), ex=self.ttl)
+
+    def delete_event(self, event_id):
+        self.client.incr(f"{self.prefix}gen:{event_id}")
+
+    def clear(self):
+        pass
+
+
+#global hit/miss counters (per worker)
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(kind):
+    with _stats_lock:
+        _stats[kind] += 1
+    if has_request_context():
+        per_request = g.setdefault('card_cache', {'hits': 0, 'misses': 0})
+        per_request[kind] += 1
+
+
+def stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def _backend():
+    return current_app.extensions.get('card_cache')
+
+
+#Render a card template for an event, or hand back the cached html
+#booking= is passed through to the template and its id becomes part of the key,
+#since booking cards show the booking details too
+def cached_card(template, event, booking=None):
+    backend = _backend()
+    if backend is None:
+        return Markup(render_template(template, event=event, booking=booking))
+
+    version = event.updated_at.timestamp() if event.updated_at else 0
+    #the image variants get built in the background, so a card cached before they
+    #existed must not stick around once they do
+    pictures = int(images.variants_ready(event.image_file))
+    key = f"{template}:{event.id}:{booking.id if booking else 0}:{version}:{event.status}:{pictures}"
+    html = backend.get(key, event.id)
+    if html is not None:
+        _count('hits')
+        return Markup(html)
+
+    _count('misses')
+    html = render_template(template, event=event, booking=booking)
+    backend.set(key, html, event.id)
+    return Markup(html)
+
+
+#Drop every cached card for an event, call after anything that changes it
+#(the anonymous full-page cache shows the same cards, so that's dropped too, and
+#anyone watching the event live gets the new tickets left / status)
+def invalidate_event(event_id):
+    backend = _backend()
+    if backend is not None:
+        backend.delete_event(event_id)
+    page_cache.invalidate_events()
+    live.notify(event_id)
+
+
+#Set up the backend from config and make cached_card() available in templates
+def init_app(app):
+    kind = app.config.get('CARD_CACHE_BACKEND', 'lru')
+    if kind == 'none':
+        backend = None
+    elif app.config.get('CARD_CACHE_CLIENT') is not None:
+        backend = SharedBackend(app.config['CARD_CACHE_CLIENT'], ttl=app.config.get('CARD_CACHE_TTL', 3600))
+    else:
+        backend = LRUBackend(app.config.get('CARD_CACHE_SIZE', 2048))
+    app.extensions['card_cache'] = backend
+    app.jinja_env.globals['cached_card'] = cached_card
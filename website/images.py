@@ -0,0 +1,289 @@
+#commented
+
+#Event image pipeline
+#
+#Before, create_event/edit_event saved the upload exactly as it came in and every
+#card served that full-size original (some of ours are ~4MB). Now:
+# 1. the upload is streamed to a temp file while the request is parsed (UploadRequest),
+#    checked against the size/pixel limits, then moved into place atomically under a
+#    content-hash filename (sha256 of the bytes), so two different files called
+#    "pool.jpg" can't overwrite each other like they could with secure_filename,
+#    and re-uploading the same picture reuses it
+# 2. a background worker pool makes the resized variants OFF the request thread:
+#       uploads/variants/<name>-card.jpg / .webp   (600px wide, for cards)
+#       uploads/variants/<name>-hero.jpg / .webp   (1600px wide, for view_event)
+# 3. templates use the event_picture() macro (_macros.html) which emits a
+#    <picture> with a webp <source> + srcset once the variants exist, and just the
+#    original until then
+#Since the names are content hashes the files never change, so they can be cached forever.
+#
+#Pillow is needed for the resizing, if it isn't installed uploads still work and
+#pages just keep serving the originals.
+#Existing uploads can be processed with:  flask --app main build-image-variants
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+from flask import current_app, Request
+from flask.cli import with_appcontext
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  #pragma: no cover - Pillow is optional
+    Image = None
+
+#name -> width in pixels
+SIZES = {'card': 600, 'hero': 1600}
+#(extension, Pillow format, save options)
+FORMATS = [
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+
+#read/write uploads in 64KB pieces
+CHUNK_SIZE = 64 * 1024
+
+#mode for files we put in static/ (rw-r--r-- minus the umask). The temp files they
+#start out as are 0600, which a separate static server (nginx) can't read
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o644 & ~_umask
+
+_executor = None
+_executor_lock = threading.Lock()
+#files we've already seen variants for
+_ready = set()
+#files we found WITHOUT variants -> when we looked (time.monotonic()). Old uploads
+#that never got variants would otherwise cost 4 os.path.exists per card render,
+#so a miss is believed for NOT_READY_TTL seconds before looking again
+_not_ready = {}
+NOT_READY_TTL = 30
+
+
+def upload_dir(app=None):
+    app = app or current_app
+    return os.path.join(app.root_path, 'static', 'uploads')
+
+
+def variant_dir(app=None):
+    return os.path.join(upload_dir(app), 'variants')
+
+
+def _variant_name(filename, size, ext):
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}-{size}.{ext}"
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get('IMAGE_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-variants')
+        return _executor
+
+
+#Raised when an upload breaks one of the limits, message is safe to flash
+class UploadError(Exception):
+    pass
+
+
+#where multipart file parts get streamed to while the request is parsed
+#(same filesystem as static/uploads so the final move is just a link/rename)
+def upload_tmp_dir(app=None):
+    app = app or current_app
+    path = os.path.join(app.instance_path, 'upload-tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+#Request class that streams every uploaded file straight into a named temp file
+#in upload_tmp_dir() as Werkzeug parses the body (a chunk at a time, so a big
+#upload never sits in worker memory). The temp file deletes itself when the
+#request is closed unless save_upload() has linked it into place first.
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile('w+b', dir=upload_tmp_dir(), prefix='upload-', suffix='.part')
+
+
+#Save an uploaded FileStorage under a content-hash name and queue its variants
+#returns the stored filename (what goes in Event.image_file)
+# - size is checked while hashing (MAX_CONTENT_LENGTH already stops anything way
+#   too big before it's even parsed)
+# - pixel count is read from the image header only, before anything decodes it,
+#   so a tiny file that decompresses into a huge image gets rejected cheaply
+# - the file lands in static/uploads in one atomic step (hard link of the temp
+#   file, or copy-to-temp + os.replace), so a half written image is never served
+def save_upload(file_storage):
+    ext = os.path.splitext(file_storage.filename or '')[1].lower() or '.jpg'
+    if ext == '.jpeg':
+        ext = '.jpg'
+
+    max_bytes = current_app.config.get('UPLOAD_MAX_BYTES')
+    stream = file_storage.stream
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        size += len(chunk)
+        if max_bytes and size > max_bytes:
+            raise UploadError(f"Image is too large (max {max_bytes // (1024 * 1024)} MB).")
+        digest.update(chunk)
+    _check_pixels(stream)
+
+    filename = digest.hexdigest()[:32] + ext
+    path = os.path.join(upload_dir(), filename)
+    if not os.path.exists(path):
+        _move_into_place(stream, path)
+
+    queue_variants(filename)
+    return filename
+
+
+def _check_pixels(stream):
+    if Image is None:
+        return
+    max_pixels = current_app.config.get('UPLOAD_MAX_PIXELS')
+    stream.seek(0)
+    try:
+        #Image.open only reads the header here, no pixel data is decoded
+        with Image.open(stream) as image:
+            width, height = image.size
+    except Exception:
+        raise UploadError("That file doesn't look like an image.")
+    if max_pixels and width * height > max_pixels:
+        raise UploadError(f"Image is too big ({width}x{height}), please upload a smaller one.")
+
+
+def _move_into_place(stream, path):
+    source = getattr(stream, 'name', None)
+    if isinstance(source, str) and os.path.dirname(source) == upload_tmp_dir():
+        try:
+            #a hard link shares the temp file's mode, so open it up before it appears
+            os.chmod(source, FILE_MODE)
+            os.link(source, path)
+            return
+        except FileExistsError:
+            return  #someone else saved the same image a moment ago
+        except OSError:
+            pass  #different filesystem / not supported -> copy below
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    stream.seek(0)
+    with open(tmp, 'wb') as out:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            out.write(chunk)
+    os.chmod(tmp, FILE_MODE)  #same mode whichever way the file got here
+    os.replace(tmp, path)
+
+
+#Kick off variant generation in the worker pool (returns straight away)
+def queue_variants(filename):
+    if Image is None or not filename:
+        return None
+    logger = current_app.logger
+    future = _pool().submit(build_variants, upload_dir(), filename)
+
+    #errors in the worker would otherwise vanish with the future, so log them
+    def report(done):
+        if done.exception() is not None:
+            logger.error("Building image variants for %s failed", filename, exc_info=done.exception())
+
+    future.add_done_callback(report)
+    return future
+
+
+#Make every size/format variant of one upload, skips ones that already exist
+#Runs in a worker thread so it only takes plain paths, no app context needed
+def build_variants(source_dir, filename):
+    if Image is None:
+        return []
+    out_dir = os.path.join(source_dir, 'variants')
+    os.makedirs(out_dir, exist_ok=True)
+    made = []
+    with Image.open(os.path.join(source_dir, filename)) as original:
+        #respect the camera rotation flag, then drop alpha for jpeg
+        image = ImageOps.exif_transpose(original).convert('RGB')
+        for size, width in SIZES.items():
+            resized = image
+            if image.width > width:
+                height = round(image.height * width / image.width)
+                resized = image.resize((width, height), Image.LANCZOS)
+            for ext, fmt, options in FORMATS:
+                target = os.path.join(out_dir, _variant_name(filename, size, ext))
+                if os.path.exists(target):
+                    continue
+                #write to a unique temp name then rename, so a half written file is never
+                #served and two builds of the same upload (pool + the CLI) can't collide
+                fd, tmp = tempfile.mkstemp(dir=out_dir, prefix='.' + os.path.basename(target), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as out:
+                        resized.save(out, fmt, **options)
+                    os.chmod(tmp, FILE_MODE)  #mkstemp makes it 0600
+                    os.replace(tmp, target)
+                except BaseException:
+                    os.unlink(tmp)
+                    raise
+                made.append(target)
+    #all there now, tell variants_ready() straight away instead of after NOT_READY_TTL
+    _ready.add(filename)
+    _not_ready.pop(filename, None)
+    return made
+
+
+#Are all the variants for this upload on disk yet?
+def variants_ready(filename):
+    if not filename or Image is None:
+        return False
+    if filename in _ready:
+        return True
+    checked_at = _not_ready.get(filename)
+    if checked_at is not None and time.monotonic() - checked_at < NOT_READY_TTL:
+        return False
+    out_dir = variant_dir()
+    ready = all(
+        os.path.exists(os.path.join(out_dir, _variant_name(filename, size, ext)))
+        for size in SIZES for ext, _, _ in FORMATS
+    )
+    if ready:
+        _ready.add(filename)
+        _not_ready.pop(filename, None)
+    else:
+        _not_ready[filename] = time.monotonic()
+    return ready
+
+
+#Everything the event_picture() macro needs for one image, or None if the
+#variants aren't ready yet (then the macro just uses the original)
+#srcset offers the variant for `size` plus the smaller card one for hero images,
+#as (variant filename, width) pairs -> the macro turns them into url_for() urls
+def picture_sources(filename, size):
+    if not variants_ready(filename):
+        return None
+    wanted = ['card'] if size == 'card' else ['card', 'hero']
+    return {
+        'webp': [(_variant_name(filename, s, 'webp'), SIZES[s]) for s in wanted],
+        'jpg': [(_variant_name(filename, s, 'jpg'), SIZES[s]) for s in wanted],
+        'src': _variant_name(filename, size, 'jpg'),
+    }
+
+
+@click.command('build-image-variants')
+@with_appcontext
+def build_image_variants_command():
+    if Image is None:
+        click.echo("Pillow isn't installed, can't build image variants.")
+        return
+    source_dir = upload_dir()
+    count = 0
+    for name in sorted(os.listdir(source_dir)):
+        if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png'):
+            try:
+                count += len(build_variants(source_dir, name))
+            except OSError as e:
+                click.echo(f"Skipping {name}: {e}")
+    click.echo(f"Wrote {count} image variant(s).")
@@ -0,0 +1,195 @@
+#commented
+
+#Live ticket availability (Server-Sent Events)
+#
+#People watching a nearly sold out event on view_event kept hitting reload, and every
+#reload is a whole page render. Now view_event opens an EventSource on
+#   GET /<id>/live   (text/event-stream)
+#and gets a "tickets" message with {tickets_left, status} whenever they change, so
+#the booking panel updates in place.
+#
+#How updates get to the clients:
+# - ONE Broadcaster per worker with one background thread. Clients don't poll
+#   anything, each connection just waits on its own Subscription
+# - fragment_cache.invalidate_event() (called after every booking, cancellation and
+#   edit) pokes the broadcaster, which reads that event's row ONCE and pushes it to
+#   every client watching it
+# - changes made by OTHER workers (or bulk imports / the status refresh) are picked
+#   up by one query every LIVE_POLL_SECONDS for all the events this worker has
+#   watchers for, again once per worker however many clients there are
+# - a Subscription only keeps the newest state, so a slow client never builds up a
+#   backlog, it just skips straight to the latest numbers
+# - a comment line goes out every LIVE_KEEPALIVE_SECONDS so proxies don't drop idle
+#   connections, and at most LIVE_MAX_CONNECTIONS streams are open per worker (503 past that)
+#
+#The stream doesn't hold a db connection or the request context while it waits.
+#On the threaded dev server every open stream is a thread, for thousands of idle
+#connections run an async worker (e.g. gunicorn -k gevent --worker-connections 5000),
+#the threading primitives used here are patched into greenlets there.
+
+import json
+import threading
+import time
+
+from flask import Response, current_app
+
+from . import db
+from .models import Event
+
+
+#One client's view of one event: only the newest state is kept
+class Subscription:
+    def __init__(self, event_id):
+        self.event_id = event_id
+        self.latest = None
+        self._ready = threading.Event()
+
+    def push(self, state):
+        self.latest = state
+        self._ready.set()
+
+    #wait up to timeout for a new state, returns it or None
+    def wait(self, timeout):
+        if not self._ready.wait(timeout):
+            return None
+        self._ready.clear()
+        return self.latest
+
+
+#Per worker fan-out from the db to every open stream
+class Broadcaster:
+    def __init__(self, app, poll_seconds=2.0):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        #event id -> set of Subscriptions
+        self._subscribers = {}
+        #event id -> last state sent {tickets_left, status}
+        self._states = {}
+        #events changed in this worker, checked straight away
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.stats = {'updates_sent': 0, 'db_checks': 0}
+
+    def connections(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, event_id, state):
+        sub = Subscription(event_id)
+        with self._lock:
+            self._subscribers.setdefault(event_id, set()).add(sub)
+            self._states.setdefault(event_id, state)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-broadcaster', daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.event_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.event_id]
+                    self._states.pop(sub.event_id, None)
+
+    #something changed this event, check it now (cheap no-op if nobody watches it)
+    def notify(self, event_id):
+        with self._lock:
+            if event_id not in self._subscribers:
+                return
+            self._pending.add(event_id)
+        self._wake.set()
+
+    #a poke only checks the pending events, but every watched event is still checked
+    #at least once every poll_seconds, or a steady stream of local bookings would keep
+    #changes from other workers / imports / the status job from ever getting through
+    def _run(self):
+        next_poll = time.monotonic() + self.poll_seconds
+        while True:
+            self._wake.wait(max(0.0, next_poll - time.monotonic()))
+            self._wake.clear()
+            now = time.monotonic()
+            with self._lock:
+                ids, self._pending = self._pending, set()
+                if now >= next_poll:
+                    ids |= set(self._subscribers)
+                    next_poll = now + self.poll_seconds
+            if ids:
+                try:
+                    self._check(ids)
+                except Exception:
+                    self.app.logger.exception("Live update check failed")
+
+    #read the current state of these events (one query) and push what changed
+    def _check(self, ids):
+        with self.app.app_context():
+            rows = db.session.execute(
+                db.select(Event.id, Event.tickets_left, Event.status).where(Event.id.in_(ids))
+            ).all()
+        self.stats['db_checks'] += 1
+        for event_id, tickets_left, status in rows:
+            state = {'tickets_left': tickets_left, 'status': status}
+            with self._lock:
+                if self._states.get(event_id) == state or event_id not in self._subscribers:
+                    continue
+                self._states[event_id] = state
+                subs = list(self._subscribers[event_id])
+            for sub in subs:
+                sub.push(state)
+            self.stats['updates_sent'] += len(subs)
+
+
+def _broadcaster():
+    return current_app.extensions.get('live')
+
+
+#Called after an event changes (see fragment_cache.invalidate_event)
+def notify(event_id):
+    broadcaster = _broadcaster()
+    if broadcaster is not None:
+        broadcaster.notify(event_id)
+
+
+def stats():
+    broadcaster = _broadcaster()
+    if broadcaster is None:
+        return {'connections': 0, 'updates_sent': 0, 'db_checks': 0}
+    return dict(broadcaster.stats, connections=broadcaster.connections())
+
+
+def _message(state):
+    return f"event: tickets\ndata: {json.dumps(state)}\n\n"
+
+
+#The SSE response for one event, current state first then every change
+#returns None if this worker already has LIVE_MAX_CONNECTIONS streams open
+def stream(event):
+    broadcaster = _broadcaster()
+    if broadcaster.connections() >= current_app.config.get('LIVE_MAX_CONNECTIONS', 1000):
+        return None
+    keepalive = current_app.config.get('LIVE_KEEPALIVE_SECONDS', 15)
+    state = {'tickets_left': event.tickets_left, 'status': event.status}
+    sub = broadcaster.subscribe(event.id, state)
+
+    #no stream_with_context on purpose: nothing here needs the request or the db
+    def generate():
+        try:
+            #browsers reconnect on their own after `retry` ms if the stream drops
+            yield f"retry: 5000\n{_message(state)}"
+            while True:
+                update = sub.wait(keepalive)
+                yield ": keepalive\n\n" if update is None else _message(update)
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx: send each message straight away
+    return response
+
+
+def init_app(app):
+    app.extensions['live'] = Broadcaster(app, app.config.get('LIVE_POLL_SECONDS', 2.0))
@@ -0,0 +1,279 @@
+#commented
+
+#Request instrumentation + Prometheus /metrics
+#
+#All we had before was the console log handler and a few print()s. This records, for
+#every request:
+#   endpoint, wall time, time spent in the database, number of SQL statements,
+#   time spent rendering templates and the response size
+#and keeps per-endpoint totals plus a latency histogram that Prometheus can scrape
+#from /metrics (plain text exposition format, no extra packages needed).
+#
+#Also:
+# - SQL statements slower than SLOW_QUERY_MS (default 200) are logged as warnings
+#   with their parameters, from requests AND from CLI commands / background jobs
+#   (except writes to the user table, those carry password hashes and emails)
+# - with QUERY_COUNT_HEADER on (debug) each response gets a Server-Timing header, so
+#   the browser dev tools show the db / template / total split
+# - the card, user and page cache hit/miss counters are exported too, and the
+#   admitted / shed counts from admission.py
+# - /metrics needs METRICS_TOKEN (send "Authorization: Bearer <token>"), without a
+#   token set it only answers local requests (a scraper on the same box), it's a 404
+#   for everyone else since it lists every endpoint and cache/admission counter
+#
+#The numbers are per worker process, Prometheus adds them up across workers.
+
+import hmac
+import re
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import admission, fragment_cache, live, page_cache, queries, user_cache
+
+#latency histogram buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+#longest parameter list written to the slow query log
+MAX_PARAMS_LOGGED = 500
+#statements whose parameters never go in the log (password hashes, emails)
+REDACTED_STATEMENTS = re.compile(r'^\s*(INSERT\s+INTO|UPDATE)\s+"?user"?[\s(]', re.IGNORECASE)
+
+
+#All the per-endpoint numbers for one worker
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        #(endpoint, method, status) -> count
+        self.requests = {}
+        #endpoint -> {'buckets': [..], 'count', 'sum', 'db', 'sql', 'template', 'bytes'}
+        self.endpoints = {}
+        self.slow_queries = 0
+
+    def observe(self, endpoint, method, status, seconds, db_seconds, statements, template_seconds, size):
+        with self._lock:
+            key = (endpoint, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = {
+                    'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0,
+                    'db': 0.0, 'sql': 0, 'template': 0.0, 'bytes': 0,
+                }
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][i] += 1
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['db'] += db_seconds
+            stats['sql'] += statements
+            stats['template'] += template_seconds
+            stats['bytes'] += size
+
+    def count_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    def snapshot(self):
+        with self._lock:
+            return (dict(self.requests),
+                    {k: dict(v, buckets=list(v['buckets'])) for k, v in self.endpoints.items()},
+                    self.slow_queries)
+
+
+registry = Registry()
+
+
+#---------------------------------------------------------------------------------
+#SQL TIMING + SLOW QUERY LOG
+#---------------------------------------------------------------------------------
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_start(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_end(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    if has_request_context():
+        g.db_time = g.get('db_time', 0.0) + elapsed
+    threshold = _slow_query_seconds()
+    if threshold is not None and elapsed >= threshold:
+        registry.count_slow_query()
+        params = '[redacted]' if REDACTED_STATEMENTS.match(statement) else repr(parameters)
+        if len(params) > MAX_PARAMS_LOGGED:
+            params = params[:MAX_PARAMS_LOGGED] + '...'
+        _logger().warning("Slow query (%.1f ms): %s | params: %s", elapsed * 1000, ' '.join(statement.split()), params)
+
+
+def _slow_query_seconds():
+    try:
+        ms = current_app.config.get('SLOW_QUERY_MS', 200)
+    except RuntimeError:  #no app context (shouldn't happen, but never break a query over it)
+        return None
+    return ms / 1000 if ms and ms > 0 else None
+
+
+def _logger():
+    return current_app.logger
+
+
+#---------------------------------------------------------------------------------
+#TEMPLATE TIMING
+#---------------------------------------------------------------------------------
+#cached_card() renders card templates INSIDE the page template, so only the
+#outermost render is timed (depth counter) or the cards would be counted twice
+
+def _template_start(sender, template, context, **extra):
+    if not has_request_context():
+        return
+    depth = g.get('template_depth', 0)
+    if depth == 0:
+        g.template_start = time.perf_counter()
+    g.template_depth = depth + 1
+
+
+def _template_end(sender, template, context, **extra):
+    if not has_request_context() or not g.get('template_depth'):
+        return
+    g.template_depth -= 1
+    if g.template_depth == 0:
+        g.template_time = g.get('template_time', 0.0) + time.perf_counter() - g.template_start
+
+
+#---------------------------------------------------------------------------------
+#/metrics
+#---------------------------------------------------------------------------------
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    requests, endpoints, slow_queries = registry.snapshot()
+    lines = []
+
+    def header(name, kind, text):
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    header('poolbnb_http_requests_total', 'counter', "Requests handled, by endpoint, method and status.")
+    for (endpoint, method, status), count in sorted(requests.items()):
+        lines.append(f'poolbnb_http_requests_total{{endpoint="{_label(endpoint)}",method="{method}",status="{status}"}} {count}')
+
+    header('poolbnb_http_request_duration_seconds', 'histogram', "Wall time per request, by endpoint.")
+    for endpoint, stats in sorted(endpoints.items()):
+        label = _label(endpoint)
+        for bound, count in zip(BUCKETS, stats['buckets']):
+            lines.append(f'poolbnb_http_request_duration_seconds_bucket{{endpoint="{label}",le="{bound}"}} {count}')
+        lines.append(f'poolbnb_http_request_duration_seconds_bucket{{endpoint="{label}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'poolbnb_http_request_duration_seconds_sum{{endpoint="{label}"}} {stats["sum"]:.6f}')
+        lines.append(f'poolbnb_http_request_duration_seconds_count{{endpoint="{label}"}} {stats["count"]}')
+
+    totals = [
+        ('poolbnb_db_seconds_total', 'db', "Time spent running SQL, by endpoint."),
+        ('poolbnb_sql_statements_total', 'sql', "SQL statements run, by endpoint."),
+        ('poolbnb_template_seconds_total', 'template', "Time spent rendering templates, by endpoint."),
+        ('poolbnb_response_bytes_total', 'bytes', "Response body bytes sent, by endpoint."),
+    ]
+    for name, field, text in totals:
+        header(name, 'counter', text)
+        for endpoint, stats in sorted(endpoints.items()):
+            value = stats[field]
+            value = f"{value:.6f}" if isinstance(value, float) else value
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {value}')
+
+    header('poolbnb_slow_queries_total', 'counter', "SQL statements slower than SLOW_QUERY_MS.")
+    lines.append(f"poolbnb_slow_queries_total {slow_queries}")
+
+    #the caches
+    header('poolbnb_cache_requests_total', 'counter', "Cache lookups by cache and result.")
+    for cache, stats in (('card', fragment_cache.stats()), ('user', user_cache.stats())):
+        lines.append(f'poolbnb_cache_requests_total{{cache="{cache}",result="hit"}} {stats["hits"]}')
+        lines.append(f'poolbnb_cache_requests_total{{cache="{cache}",result="miss"}} {stats["misses"]}')
+    header('poolbnb_page_cache_requests_total', 'counter', "Anonymous page cache results, by endpoint.")
+    for endpoint, counts in sorted(page_cache.stats().items()):
+        for result, count in sorted(counts.items()):
+            lines.append(f'poolbnb_page_cache_requests_total{{endpoint="{_label(endpoint)}",result="{result}"}} {count}')
+
+    header('poolbnb_admission_requests_total', 'counter', "Guarded POSTs by rule and result (admitted / rate_limited / overloaded).")
+    for rule, counts in sorted(admission.stats().items()):
+        for result, count in sorted(counts.items()):
+            lines.append(f'poolbnb_admission_requests_total{{rule="{rule}",result="{result}"}} {count}')
+
+    live_stats = live.stats()
+    header('poolbnb_live_connections', 'gauge', "Open Server-Sent Events streams (live tickets left).")
+    lines.append(f"poolbnb_live_connections {live_stats['connections']}")
+    header('poolbnb_live_updates_total', 'counter', "Live updates sent to clients.")
+    lines.append(f"poolbnb_live_updates_total {live_stats['updates_sent']}")
+    header('poolbnb_live_db_checks_total', 'counter', "Queries the live broadcaster ran to look for changes.")
+    lines.append(f"poolbnb_live_db_checks_total {live_stats['db_checks']}")
+
+    return '\n'.join(lines) + '\n'
+
+
+#straight from this machine, not relayed by a proxy on it
+def _local_request():
+    return request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+
+
+def metrics_view():
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        if not _local_request():
+            return "Not found\n", 404, {'Content-Type': 'text/plain'}
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').encode('utf-8'),
+                                 f"Bearer {token}".encode('utf-8')):
+        return "Forbidden\n", 403, {'Content-Type': 'text/plain'}
+    return render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+#---------------------------------------------------------------------------------
+#SETUP
+#---------------------------------------------------------------------------------
+
+def init_app(app):
+    before_render_template.connect(_template_start, app)
+    template_rendered.connect(_template_end, app)
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    #registered before the other after_request hooks so it runs LAST and sees the
+    #final response (flask runs them in reverse order)
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is None or request.endpoint == 'metrics':
+            return response
+        elapsed = time.perf_counter() - start
+        db_time = g.get('db_time', 0.0)
+        template_time = g.get('template_time', 0.0)
+        statements = queries.query_count()
+        #streamed responses (is_sequence False) aren't counted, reading them here would buffer them
+        size = response.content_length
+        if size is None:
+            size = len(response.get_data()) if response.is_sequence else 0
+        endpoint = request.endpoint or 'unmatched'
+
+        registry.observe(endpoint, request.method, response.status_code, elapsed, db_time,
+                         statements, template_time, size)
+        app.logger.debug("%s %s -> %s in %.1f ms (db %.1f ms, %d sql, templates %.1f ms, %d bytes)",
+                         request.method, endpoint, response.status_code, elapsed * 1000, db_time * 1000,
+                         statements, template_time * 1000, size)
+        if app.config.get('QUERY_COUNT_HEADER'):
+            response.headers['Server-Timing'] = (f"db;dur={db_time * 1000:.1f}, "
+                                                 f"tpl;dur={template_time * 1000:.1f}, "
+                                                 f"total;dur={elapsed * 1000:.1f}")
+        return response
+
+    if app.config.get('METRICS_ENABLED', True):
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,204 @@
+#commented
+
+#Schema migrations
+#
+#db.create_all() only ever creates MISSING tables, it never adds a new column or
+#index to a table that already exists. So an existing sitedata.sqlite would never
+#pick up things like Event.tickets_sold or the new indexes.
+#
+#This is a small migration runner:
+# - every migration is a named function in MIGRATIONS, applied in order
+# - the names of applied migrations are recorded in the schema_migrations table
+#   so each one only ever runs once per database
+# - each migration also checks before it changes anything, so running it against a
+#   db that already has the change (e.g. a brand new one from create_all) is harmless
+#
+#Run it with:  flask --app main db-upgrade
+#create_app() also runs it on startup unless AUTO_MIGRATE=0. Several workers starting
+#at once is fine, they take turns (see migration_lock below).
+#
+#To add a migration: write a function below and append it to MIGRATIONS.
+#NEVER rename or reorder existing ones, they're identified by name.
+
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+
+from . import db
+
+#bookkeeping table, one row per applied migration
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+
+#column type spelled the way this database wants it (DATETIME on sqlite, TIMESTAMP
+#WITHOUT TIME ZONE on postgres, which has no DATETIME)
+def _sql_type(sqltype):
+    return sqltype.compile(dialect=db.engine.dialect)
+
+
+def _has_column(table_name, column_name):
+    columns = inspect(db.engine).get_columns(table_name)
+    return any(c['name'] == column_name for c in columns)
+
+
+#---------------------------------------------------------------------------------
+#MIGRATIONS
+#---------------------------------------------------------------------------------
+
+#creates any tables that don't exist yet (a brand new db gets everything here)
+def m0001_baseline():
+    db.create_all()
+
+
+#Event.tickets_sold counter (see models.Event), then fill it from the bookings
+#(plain SQL on purpose, migrations must not depend on what the models look like later)
+def m0002_event_tickets_sold():
+    if not _has_column('event', 'tickets_sold'):
+        db.session.execute(text("ALTER TABLE event ADD COLUMN tickets_sold INTEGER NOT NULL DEFAULT 0"))
+    db.session.execute(text(
+        "UPDATE event SET tickets_sold = "
+        "(SELECT COALESCE(SUM(quantity), 0) FROM booking WHERE booking.event_id = event.id)"
+    ))
+
+
+#indexes for the hot queries:
+# - event (date, id)                   -> /list, /home, index, keyset paging
+# - booking (user_id, date, id)        -> my_bookings
+# - booking (event_id)                 -> per-event booking lookups / reconcile
+# - comment (event_id, date_created)   -> comments on view_event
+# - user (name)                        -> auth.login
+#spelled out rather than taken from the models, so changing an index later doesn't
+#change what this migration did. IF NOT EXISTS skips any index that's already there
+HOT_QUERY_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS ix_event_date_id ON event (date, id)',
+    'CREATE INDEX IF NOT EXISTS ix_booking_user_date_id ON booking (user_id, date, id)',
+    'CREATE INDEX IF NOT EXISTS ix_booking_event_id ON booking (event_id)',
+    'CREATE INDEX IF NOT EXISTS ix_comment_event_date ON comment (event_id, date_created)',
+    'CREATE INDEX IF NOT EXISTS ix_user_name ON "user" (name)',
+]
+
+
+def m0003_hot_query_indexes():
+    for statement in HOT_QUERY_INDEXES:
+        db.session.execute(text(statement))
+
+
+#full-text search index for /home (see search.py)
+def m0004_search_index():
+    from . import search
+    search.build_index()
+
+
+#Event.updated_at, used by the event card cache (fragment_cache.py)
+def m0005_event_updated_at():
+    if not _has_column('event', 'updated_at'):
+        db.session.execute(text(f"ALTER TABLE event ADD COLUMN updated_at {_sql_type(db.DateTime())}"))
+    db.session.execute(text("UPDATE event SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL"))
+
+
+#Event.comment_count (see models.Event), filled from the comments table
+def m0006_event_comment_count():
+    if not _has_column('event', 'comment_count'):
+        db.session.execute(text("ALTER TABLE event ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0"))
+    db.session.execute(text(
+        "UPDATE event SET comment_count = "
+        "(SELECT COUNT(*) FROM comment WHERE comment.event_id = event.id)"
+    ))
+
+
+#Event.waiting_room_rate (see waiting_room.py), empty = no waiting room
+def m0007_event_waiting_room_rate():
+    if not _has_column('event', 'waiting_room_rate'):
+        db.session.execute(text("ALTER TABLE event ADD COLUMN waiting_room_rate INTEGER"))
+
+
+MIGRATIONS = [
+    m0001_baseline,
+    m0002_event_tickets_sold,
+    m0003_hot_query_indexes,
+    m0004_search_index,
+    m0005_event_updated_at,
+    m0006_event_comment_count,
+    m0007_event_waiting_room_rate,
+]
+
+
+#---------------------------------------------------------------------------------
+#RUNNER
+#---------------------------------------------------------------------------------
+
+#names of the migrations already applied to this db
+def applied_migrations():
+    schema_migrations.create(db.engine, checkfirst=True)
+    return set(db.session.scalars(db.select(schema_migrations.c.name)))
+
+
+#Only one process may migrate at a time. Workers booting together would otherwise
+#all find the same migration missing and run the same ALTER TABLE (duplicate column)
+#or insert the same schema_migrations row. The lock is held on its own connection so
+#it doesn't get in the way of the migrations' own queries:
+# - postgres -> pg_advisory_lock
+# - sqlite   -> BEGIN EXCLUSIVE on a little side file next to the db (<db>-migrate.lock)
+#The next worker waits for it, then finds everything already applied.
+MIGRATION_LOCK_KEY = 72070001
+MIGRATION_LOCK_TIMEOUT = 600  # seconds, the search index build can take a while
+
+
+@contextmanager
+def migration_lock():
+    url = db.engine.url
+    backend = url.get_backend_name()
+    if backend == 'postgresql':
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': MIGRATION_LOCK_KEY})
+    elif backend == 'sqlite' and url.database and url.database != ':memory:':
+        lock = sqlite3.connect(url.database + '-migrate.lock', timeout=MIGRATION_LOCK_TIMEOUT,
+                               isolation_level=None)
+        try:
+            lock.execute("BEGIN EXCLUSIVE")
+            yield
+        finally:
+            lock.close()  # closing rolls back and lets the next worker in
+    else:
+        #in-memory sqlite is one process anyway
+        yield
+
+
+#apply every migration that hasn't run yet, returns the names applied
+def upgrade():
+    with migration_lock():
+        done = applied_migrations()
+        applied = []
+        for migration in MIGRATIONS:
+            name = migration.__name__
+            if name in done:
+                continue
+            current_app.logger.info("Applying migration %s", name)
+            migration()
+            db.session.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+            db.session.commit()
+            applied.append(name)
+    return applied
+
+
+@click.command('db-upgrade')
+@with_appcontext
+def db_upgrade_command():
+    applied = upgrade()
+    if applied:
+        click.echo("Applied: " + ", ".join(applied))
+    else:
+        click.echo("Database is up to date.")
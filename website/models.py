@@ -3,9 +3,15 @@
 from . import db
 from datetime import datetime, time
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 
 # User Model
 class User(db.Model, UserMixin):
+    #auth.login looks users up by name
+    __table_args__ = (
+        db.Index('ix_user_name', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
@@ -29,13 +35,30 @@ class User(db.Model, UserMixin):
     
 # Event Model
 class Event(db.Model):
+    #index for the listing pages, they filter/sort on date and page with (date, id)
+    __table_args__ = (
+        db.Index('ix_event_date_id', 'date', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False)
     description = db.Column(db.Text)
     location = db.Column(db.Text, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
+    #NEW: running total of tickets booked for this event
+    #This is kept up to date in the same transaction that inserts a Booking, so
+    #pages can show what's left without doing SUM(Booking.quantity) every time.
+    #If it ever drifts, `flask reconcile-tickets` rebuilds it from the bookings table.
+    tickets_sold = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     cost = db.Column(db.Float, default=0.0)
-    status = db.Column(db.String(30), nullable=False)
+    #NEW: running total of comments, bumped in the same transaction as the comment insert
+    #so cards can show it without a COUNT per card (reconcile-tickets also rebuilds it)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    #NEW: opt-in waiting room for big on-sales, bookings let in per minute (None = off)
+    #see waiting_room.py
+    waiting_room_rate = db.Column(db.Integer, nullable=True)
+    #the status as last written to the db (see the status hybrid below)
+    stored_status = db.Column('status', db.String(30), nullable=False, default='Open')
     features = db.Column(db.Text, default='regular')
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
     
@@ -46,6 +69,10 @@ class Event(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)  
     #removed time, not really needed
     
+    #NEW: when the event row last changed (edits, bookings, cancels, status refreshes)
+    #onupdate makes SQLAlchemy bump it on every UPDATE, it's what the card cache keys on
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
     #NEW: store image filename/path
     image_file = db.Column(db.String(255), nullable=True, default='default.jpg')
     
@@ -61,8 +88,63 @@ class Event(db.Model):
     # - lazy=True means only loaded when used.
     comments = db.relationship('Comment', backref='event', lazy=True)
 
+    #tickets still available -> works on an instance (event.tickets_left)
+    #and as a SQL expression in queries (Event.tickets_left > 0)
+    @hybrid_property
+    def tickets_left(self):
+        return self.capacity - (self.tickets_sold or 0)
+
+    @tickets_left.expression
+    def tickets_left(cls):
+        return cls.capacity - cls.tickets_sold
+
+    #NEW: status worked out at read time
+    #view_event used to recompute the status and COMMIT it on every page view, which
+    #turned every GET into a write. Now the status is derived when it's read:
+    # - Cancelled is a real decision by the creator so that one comes from the db
+    # - Closed    -> the event date has passed
+    # - Sold Out  -> no tickets left
+    # - otherwise Open
+    #It also works inside queries (e.g. .where(Event.status == 'Open')) as a CASE expression.
+    #The stored value only gets written on actual transitions (booking, cancel, edit,
+    #the scheduled status job) through the setter / sync_status().
+    @hybrid_property
+    def status(self):
+        if (self.stored_status or '').lower() == 'cancelled':
+            return 'Cancelled'
+        if self.date and self.date < datetime.utcnow():
+            return 'Closed'
+        if self.tickets_left <= 0:
+            return 'Sold Out'
+        return 'Open'
+
+    @status.setter
+    def status(self, value):
+        self.stored_status = value
+
+    @status.expression
+    def status(cls):
+        return db.case(
+            #lower() like the python side above, a stored 'cancelled' is still cancelled
+            (db.func.lower(cls.stored_status) == 'cancelled', 'Cancelled'),
+            (cls.date < datetime.utcnow(), 'Closed'),
+            (cls.capacity - cls.tickets_sold <= 0, 'Sold Out'),
+            else_='Open'
+        )
+
+    #write the derived status back to the db column if it changed
+    #call this after something that can actually change it (edits etc)
+    def sync_status(self):
+        if self.stored_status != self.status:
+            self.stored_status = self.status
+
 # Comment Model
 class Comment(db.Model):
+    #view_event lists an event's comments newest first
+    __table_args__ = (
+        db.Index('ix_comment_event_date', 'event_id', 'date_created'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
@@ -99,6 +181,13 @@ class Order(db.Model):
 #Booking model utilised for tickets to the event
 #Booking Model
 class Booking(db.Model):
+    #my_bookings filters on the user and pages through (date, id) newest first
+    #and the ticket reconcile/per-event lookups go by event_id
+    __table_args__ = (
+        db.Index('ix_booking_user_date_id', 'user_id', 'date', 'id'),
+        db.Index('ix_booking_event_id', 'event_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True) # Primary key for the table
     user_id = db.Column(db.Integer, db.ForeignKey('user.id')) # User foriegn key
     event_id = db.Column(db.Integer, db.ForeignKey('event.id')) # Event foreign key
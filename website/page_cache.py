@@ -0,0 +1,221 @@
+#commented
+
+#Full-page cache for anonymous visitors
+#
+#Anonymous GETs of /, /list, /home?q=..., /FAQ, /contact and /TnC come out exactly the
+#same for everyone, but every one of them still ran the queries and the whole Jinja
+#render (and the FAQ/contact/TnC pages never change at all).
+#
+#Views marked with @cached_page(ttl) now keep their whole response per
+#  path + normalized query string (params sorted, blank ones dropped)
+# - only for visitors WITHOUT a session/remember cookie, anyone logged in (or with a
+#   flash message waiting) always gets a fresh render, and a response that sets a
+#   cookie is never stored
+# - an entry is fresh for `ttl` seconds, then for PAGE_CACHE_STALE more seconds it's
+#   served stale while ONE background thread re-renders it (stale-while-revalidate),
+#   so nobody waits on the render when an entry runs out
+# - pages showing events (events=True) are dropped when any event changes:
+#   invalidate_events() bumps a generation number that's part of every entry
+#   (called from the Event mapper events below, fragment_cache.invalidate_event()
+#   after bookings, and the status job)
+#
+#Per-route hit / miss / stale / bypass counters are in stats(), and every response
+#from a cached view says what happened in an X-Page-Cache header.
+#PAGE_CACHE_TTL=0 turns it off. It's per worker, the short ttl keeps workers close.
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request, session
+from sqlalchemy import event
+
+from .models import Event
+
+
+class PageCache:
+    def __init__(self, max_entries=512, stale=60):
+        self.max_entries = max_entries
+        self.stale = stale
+        #bumped whenever an event changes
+        self.generation = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        #keys being re-rendered in the background right now
+        self._refreshing = set()
+        self.stats = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def bump(self):
+        with self._lock:
+            self.generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    #True if the caller should start the background refresh for key
+    def claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def count(self, endpoint, kind):
+        with self._lock:
+            counts = self.stats.setdefault(endpoint, {'hit': 0, 'miss': 0, 'stale': 0, 'bypass': 0})
+            counts[kind] += 1
+
+
+#one stored response
+class _Entry:
+    __slots__ = ('body', 'status', 'headers', 'fresh_until', 'stale_until', 'generation')
+
+    def __init__(self, response, ttl, stale, generation):
+        self.body = response.get_data()
+        self.status = response.status_code
+        self.headers = [(k, v) for k, v in response.headers.items() if k.lower() not in ('set-cookie', 'content-length')]
+        now = time.monotonic()
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale
+        self.generation = generation
+
+    def response(self):
+        return current_app.response_class(self.body, status=self.status, headers=self.headers)
+
+
+def _cache():
+    return current_app.extensions.get('page_cache')
+
+
+def _anonymous():
+    cookies = request.cookies
+    return (current_app.config.get('SESSION_COOKIE_NAME', 'session') not in cookies
+            and current_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token') not in cookies)
+
+
+def _key():
+    params = sorted((k, v.strip()) for k, v in request.args.items(multi=True) if v.strip())
+    return request.path + '?' + '&'.join(f"{k}={v}" for k, v in params)
+
+
+def _tag(response, state):
+    response.headers['X-Page-Cache'] = state
+    #anonymous and logged in visitors get different pages for the same url
+    response.vary.add('Cookie')
+    return response
+
+
+#Cache a view's whole response for anonymous visitors
+# ttl    -> seconds an entry is fresh (default PAGE_CACHE_TTL)
+# events -> the page shows events, so drop it when any event changes
+def cached_page(ttl=None, events=True):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = _cache()
+            if cache is None or request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            endpoint = request.endpoint
+            if not _anonymous():
+                cache.count(endpoint, 'bypass')
+                return _tag(current_app.make_response(view(*args, **kwargs)), 'BYPASS')
+
+            key = _key()
+            generation = cache.generation if events else 0
+            entry = None if g.get('page_cache_refresh') else cache.get(key)
+            if entry is not None and entry.generation == generation:
+                now = time.monotonic()
+                if now < entry.fresh_until:
+                    cache.count(endpoint, 'hit')
+                    return _tag(entry.response(), 'HIT')
+                if now < entry.stale_until:
+                    cache.count(endpoint, 'stale')
+                    if cache.claim_refresh(key):
+                        _refresh_in_background(key, request.full_path, request.host_url)
+                    return _tag(entry.response(), 'STALE')
+
+            if not g.get('page_cache_refresh'):
+                cache.count(endpoint, 'miss')
+            response = current_app.make_response(view(*args, **kwargs))
+            #only plain 200s that don't set a cookie (e.g. a flash or csrf token) are shared
+            shareable = (response.status_code == 200 and not session.modified
+                         and 'Set-Cookie' not in response.headers and not response.direct_passthrough)
+            if shareable:
+                fresh_for = ttl if ttl is not None else current_app.config['PAGE_CACHE_TTL']
+                cache.set(key, _Entry(response, fresh_for, cache.stale, generation))
+            return _tag(response, 'MISS')
+        return wrapper
+    return decorator
+
+
+#re-run the view in a background thread to replace a stale entry
+#calls the view straight away rather than full_dispatch_request(), so none of the
+#before/after_request hooks see it: it isn't a real request for the metrics, doesn't
+#pick a replica and can't set primary_until stickiness on anyone's session
+def _refresh_in_background(key, full_path, base_url):
+    app = current_app._get_current_object()
+    cache = _cache()
+
+    def refresh():
+        try:
+            with app.test_request_context(full_path, base_url=base_url):
+                g.page_cache_refresh = True
+                app.view_functions[request.endpoint](**request.view_args)
+        except Exception:
+            app.logger.exception("Page cache refresh of %s failed", full_path)
+        finally:
+            cache.release_refresh(key)
+
+    threading.Thread(target=refresh, name='page-cache-refresh', daemon=True).start()
+
+
+#Drop every cached page that shows events (any event was created/changed/deleted)
+def invalidate_events():
+    if not has_app_context():
+        return
+    cache = _cache()
+    if cache is not None:
+        cache.bump()
+
+
+def stats():
+    cache = _cache()
+    if cache is None:
+        return {}
+    with cache._lock:
+        return {endpoint: dict(counts) for endpoint, counts in cache.stats.items()}
+
+
+#ORM inserts/updates/deletes of events (create, edit, cancel)
+@event.listens_for(Event, 'after_insert')
+@event.listens_for(Event, 'after_update')
+@event.listens_for(Event, 'after_delete')
+def _event_changed(mapper, connection, target):
+    invalidate_events()
+
+
+def init_app(app):
+    cache = None
+    if app.config.get('PAGE_CACHE_TTL', 30) > 0:
+        cache = PageCache(app.config.get('PAGE_CACHE_SIZE', 512), app.config.get('PAGE_CACHE_STALE', 60))
+    app.extensions['page_cache'] = cache
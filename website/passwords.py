@@ -0,0 +1,91 @@
+#commented
+
+#Password hashing off the request thread
+#
+#bcrypt is slow on purpose (~250ms of CPU per hash at cost 12), and auth.login /
+#auth.register used to run it right on the request worker. A burst of logins would
+#tie up every worker and all the other pages would just hang behind them.
+#
+#Now the hashing runs in a small bounded worker pool:
+# - PASSWORD_WORKERS threads do the bcrypt work (bcrypt releases the GIL while it
+#   hashes, so they really do run in parallel)
+# - at most PASSWORD_QUEUE_LIMIT hashes can be running or waiting at once, past that
+#   we don't queue up more, we raise PasswordPoolBusy straight away and create_app
+#   turns it into a fast 503 with a Retry-After header. A hash that takes longer
+#   than PASSWORD_TIMEOUT seconds gets the same 503
+# - BCRYPT_LOG_ROUNDS sets the cost (default 12). When it changes, existing hashes
+#   are upgraded the next time the user logs in (needs_rehash())
+#
+#The hashes are normal bcrypt ($2b$<cost>$...) so they're the same format
+#Flask-Bcrypt made before and old ones keep working.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import bcrypt
+from flask import current_app
+
+
+#Raised when the pool is full, the request should be retried a bit later
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    def __init__(self, workers=2, queue_limit=8, timeout=30):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        #one slot per hash that's running or queued
+        self._slots = threading.BoundedSemaphore(queue_limit)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            #the hash is still going (and keeps its slot until it finishes), but this
+            #request gives up with the same 503 as a full pool rather than a 500
+            raise PasswordPoolBusy()
+
+
+def _pool():
+    return current_app.extensions['password_pool']
+
+
+def _rounds():
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+
+#Hash a new password, returns the hash as a str (what goes in User.password)
+def hash_password(password):
+    rounds = _rounds()
+    hashed = _pool().run(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)))
+    return hashed.decode('utf-8')
+
+
+#Does the password match the stored hash
+def check_password(pw_hash, password):
+    return _pool().run(lambda: bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8')))
+
+
+#True if the stored hash was made with a different cost than the current setting
+def needs_rehash(pw_hash):
+    try:
+        return int(pw_hash.split('$')[2]) != _rounds()
+    except (IndexError, ValueError):
+        return True
+
+
+def init_app(app):
+    app.extensions['password_pool'] = HashPool(
+        app.config.get('PASSWORD_WORKERS', 2),
+        app.config.get('PASSWORD_QUEUE_LIMIT', 8),
+        app.config.get('PASSWORD_TIMEOUT', 30),
+    )
@@ -0,0 +1,165 @@
+#commented
+
+#Shared query layer for the listing pages
+#
+#Before this, list_events/home/index loaded a bunch of Event rows and then the
+#templates went and lazy-loaded event.creator once PER CARD (lazy=True on the
+#relationship), and my_bookings did the same thing with booking.event.
+#That's the classic N+1 problem -> 1 query for the list + 1 extra query per card.
+#
+#Everything in here builds the query with the relationships eager-loaded up front:
+# - selectinload -> one extra SELECT ... WHERE id IN (...) for the whole page
+# - joinedload   -> pulls the related row in the same SELECT with a JOIN
+#so the number of statements per page stays the same whatever the row count.
+#
+#There is also a small request-scoped query counter at the bottom so we can
+#check that a page runs a fixed number of SQL statements.
+
+from datetime import datetime
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event, or_
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload
+
+from . import db
+from .models import Event, Booking, Comment
+
+
+#---------------------------------------------------------------------------------
+#LISTING QUERIES
+#---------------------------------------------------------------------------------
+
+#base select for any page that renders event cards
+#the creator is loaded with selectinload so list_events can show "by <name>"
+#without a query per card
+def _event_cards():
+    return db.select(Event).options(selectinload(Event.creator))
+
+
+#upcoming events only (today or later), soonest first -> used by /list and /home
+#same utcnow() clock as Event.status / status_worker so an event closes and drops off at the same moment
+#keyset paginated: pass the cursor from the previous page as `after`
+#returns (events, next_cursor), next_cursor is None on the last page
+def upcoming_events(after=None, limit=None):
+    stmt = (
+        _event_cards()
+        .where(Event.date >= datetime.utcnow())
+        .order_by(Event.date.asc(), Event.id.asc())
+    )
+    position = decode_cursor(after)
+    if position:
+        #(date, id) > cursor -> uses the (date, id) index so page 50 costs the same as page 1
+        stmt = stmt.where(db.tuple_(Event.date, Event.id) > position)
+    return _page(stmt, limit, lambda e: (e.date, e.id))
+
+
+#the first few events for the landing page (views.index)
+def first_events(limit=5):
+    stmt = _event_cards().order_by(Event.date.asc()).limit(limit)
+    return db.session.scalars(stmt).all()
+
+
+#search over the same four columns /home always searched
+def search_events(term):
+    search = f"%{term}%"
+    stmt = (
+        _event_cards()
+        .where(
+            or_(
+                Event.features.ilike(search),
+                Event.title.ilike(search),
+                Event.description.ilike(search),
+                Event.location.ilike(search)
+            )
+        )
+        .order_by(Event.date.asc())
+    )
+    return db.session.scalars(stmt).all()
+
+
+#bookings for a user, newest first, keyset paginated the same way as upcoming_events
+#booking.event is a many-to-one so joinedload grabs it in the same SELECT
+def user_bookings(user_id, after=None, limit=None):
+    stmt = (
+        db.select(Booking)
+        .options(joinedload(Booking.event))
+        .where(Booking.user_id == user_id)
+        .order_by(Booking.date.desc(), Booking.id.desc())
+    )
+    position = decode_cursor(after)
+    if position:
+        stmt = stmt.where(db.tuple_(Booking.date, Booking.id) < position)
+    return _page(stmt, limit, lambda b: (b.date, b.id))
+
+
+#comments for the event page, newest first, keyset paginated like the listings
+#authors are loaded for the whole page in one go (selectinload)
+#returns (comments, next_cursor), limit defaults to COMMENT_PAGE_SIZE
+def event_comments(event_id, after=None, limit=None):
+    stmt = (
+        db.select(Comment)
+        .options(selectinload(Comment.author))
+        .where(Comment.event_id == event_id)
+        .order_by(Comment.date_created.desc(), Comment.id.desc())
+    )
+    position = decode_cursor(after)
+    if position:
+        stmt = stmt.where(db.tuple_(Comment.date_created, Comment.id) < position)
+    if limit is None:
+        limit = current_app.config.get('COMMENT_PAGE_SIZE', 20)
+    return _page(stmt, limit, lambda c: (c.date_created, c.id))
+
+
+#---------------------------------------------------------------------------------
+#KEYSET PAGINATION HELPERS
+#---------------------------------------------------------------------------------
+#Instead of OFFSET (which makes the db walk past every earlier row) each page
+#remembers the (date, id) of its last row and the next page starts after it.
+#The cursor is just that pair as text, e.g. ?after=2025-10-20T00:00:00_17
+
+def encode_cursor(date, row_id):
+    return f"{date.isoformat()}_{row_id}"
+
+
+#returns (date, id) or None if the cursor is missing/garbage
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        date_part, id_part = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except ValueError:
+        return None
+
+
+#run a keyset query for one page, grabbing one extra row to see if there's more
+def _page(stmt, limit, key):
+    if limit is None:
+        limit = current_app.config.get('PAGE_SIZE', 24)
+    rows = db.session.scalars(stmt.limit(limit + 1)).unique().all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+#---------------------------------------------------------------------------------
+#REQUEST-SCOPED QUERY COUNTER
+#---------------------------------------------------------------------------------
+#We listen on the Engine class (not a single engine) so this works for whatever
+#engine Flask-SQLAlchemy creates. The count lives on flask.g, so it resets
+#automatically for every request and statements run outside a request
+#(CLI commands etc) are just ignored.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+#how many SQL statements the current request has run so far
+def query_count():
+    if not has_request_context():
+        return 0
+    return g.get('query_count', 0)
@@ -0,0 +1,89 @@
+#commented
+
+#Read-replica routing
+#
+#Nearly all our traffic is people browsing (index, /list, /home, view_event, the
+#FAQ/contact pages), and it all used to go to the one primary database. If replica
+#databases are configured, those reads can go to a replica instead:
+#
+#   DATABASE_REPLICA_URIS="postgresql://replica1/...,postgresql://replica2/..."
+#
+#How it decides:
+# - a view marked with @replica_reads, on a GET/HEAD request, picks one replica for
+#   the whole request (random, so load spreads over them)
+# - only SELECTs go to the replica, anything that writes (flushes, db.update(),
+#   inserts) always goes to the primary, and so does everything on unmarked views
+# - read-your-writes: a request that wrote something pins that browser to the
+#   primary for REPLICA_STICKY_SECONDS (default 5) via the session cookie, so the
+#   redirect after booking / posting a comment shows the new data even if the
+#   replica hasn't caught up yet
+#
+#No replicas configured -> nothing changes, everything uses the primary.
+#
+#Locally you can try it with two sqlite files (copy the db to make the replica):
+#   DATABASE_URI=sqlite:///primary.sqlite DATABASE_REPLICA_URIS=sqlite:////full/path/replica.sqlite
+
+import random
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+
+#bind keys the replicas get in SQLALCHEMY_BINDS
+REPLICA_PREFIX = 'replica_'
+
+
+#db.session class (see __init__.py), picks the engine for each statement
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or isinstance(clause, sa.UpdateBase):
+                g.db_wrote = True
+            elif g.get('db_replica') and getattr(clause, 'is_select', False):
+                return self._db.engines[g.db_replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+#Mark a view whose GETs are fine to serve from a replica
+def replica_reads(view):
+    view.replica_reads = True
+    return view
+
+
+#bind keys of the configured replicas
+def replica_keys(app=None):
+    app = app or current_app
+    return [key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(REPLICA_PREFIX)]
+
+
+#Add the replica uris as binds, call before db.init_app(app)
+def configure(app, uris):
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    for i, uri in enumerate(uris):
+        binds[f"{REPLICA_PREFIX}{i}"] = uri
+
+
+def init_app(app):
+    keys = replica_keys(app)
+    if not keys:
+        return
+    sticky = app.config.get('REPLICA_STICKY_SECONDS', 5)
+
+    @app.before_request
+    def choose_database():
+        if request.method not in ('GET', 'HEAD'):
+            return
+        view = app.view_functions.get(request.endpoint)
+        if not getattr(view, 'replica_reads', False):
+            return
+        #this browser wrote something a moment ago, keep reading from the primary
+        if session.get('primary_until', 0) > time.time():
+            return
+        g.db_replica = random.choice(keys)
+
+    @app.after_request
+    def remember_write(response):
+        if g.get('db_wrote'):
+            session['primary_until'] = time.time() + sticky
+        return response
@@ -0,0 +1,167 @@
+#commented
+
+#Full-text search for the /home search bar
+#
+#The old search OR'd four ilike('%q%') filters together, which can't use an
+#index so every search was a full scan of the event table. This module keeps a
+#proper full-text index instead:
+# - SQLite   -> an FTS5 virtual table (event_fts) kept in sync with triggers
+# - Postgres -> a GIN index over to_tsvector(title/description/location/features)
+#Either way the index updates itself whenever an event is created/edited (the
+#triggers/expression index live in the db), so bulk imports stay in sync too.
+#
+#Results are ranked (bm25 / ts_rank), every word is prefix matched ("heat"
+#finds "heated") and we page through them with page/per_page.
+#
+#If the index hasn't been built yet (old db) we fall back to the ILIKE query
+#in queries.py so search never breaks. Build it with:
+#   flask --app main build-search-index
+
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.orm import selectinload
+
+from . import db
+from . import queries
+from .models import Event
+
+#only keep letters/numbers from the search box so users can't inject FTS syntax
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_event_fts = table('event_fts', column('rowid'))
+
+#engines we've already seen the index on (so we only check once per engine)
+_ready = set()
+
+
+#SQL used to build the index for each backend
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS event_fts USING fts5(
+        title, description, location, features,
+        content='event', content_rowid='id', tokenize='unicode61'
+    )""",
+    #keep the index in sync, only fires when a searchable column changes so
+    #bookings bumping tickets_sold don't touch the index
+    """CREATE TRIGGER IF NOT EXISTS event_fts_ai AFTER INSERT ON event BEGIN
+        INSERT INTO event_fts(rowid, title, description, location, features)
+        VALUES (new.id, new.title, new.description, new.location, new.features);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_ad AFTER DELETE ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description, location, features)
+        VALUES ('delete', old.id, old.title, old.description, old.location, old.features);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS event_fts_au AFTER UPDATE OF title, description, location, features ON event BEGIN
+        INSERT INTO event_fts(event_fts, rowid, title, description, location, features)
+        VALUES ('delete', old.id, old.title, old.description, old.location, old.features);
+        INSERT INTO event_fts(rowid, title, description, location, features)
+        VALUES (new.id, new.title, new.description, new.location, new.features);
+    END""",
+    #fill the index from whatever is already in the event table
+    "INSERT INTO event_fts(event_fts) VALUES ('rebuild')",
+]
+
+#the tsvector expression, the GIN index and the search query must use the exact same one
+_PG_TSVECTOR = ("to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || "
+                "coalesce(location, '') || ' ' || coalesce(features, ''))")
+
+_PG_DDL = [
+    f"CREATE INDEX IF NOT EXISTS ix_event_search ON event USING GIN ({_PG_TSVECTOR})",
+]
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+#SQL statements that build the search index for the current database
+def index_ddl():
+    if _dialect() == 'sqlite':
+        return _SQLITE_DDL
+    if _dialect() == 'postgresql':
+        return _PG_DDL
+    return []
+
+
+#Create (or rebuild) the search index
+def build_index():
+    for statement in index_ddl():
+        db.session.execute(text(statement))
+    db.session.commit()
+    _ready.add(db.engine.url)
+
+
+#Is the full-text index there? (checked once per engine, then remembered)
+def index_ready():
+    url = db.engine.url
+    if url in _ready:
+        return True
+    if _dialect() == 'sqlite':
+        found = db.session.scalar(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'event_fts'"))
+    elif _dialect() == 'postgresql':
+        found = db.session.scalar(text("SELECT 1 FROM pg_indexes WHERE indexname = 'ix_event_search'"))
+    else:
+        found = None
+    if found:
+        _ready.add(url)
+    return bool(found)
+
+
+#turn the raw search box text into word tokens
+def _tokens(term):
+    return _TOKEN_RE.findall(term.lower())
+
+
+#Ranked, prefix-matched, paginated search
+#returns (events, has_more) for the requested page
+def search_events(term, page=1, per_page=24):
+    tokens = _tokens(term)
+    if not tokens:
+        return [], False
+    page = max(page, 1)
+
+    if not index_ready():
+        #no index yet, old ILIKE search (already ordered by date) paged in python
+        events = queries.search_events(term)
+        start = (page - 1) * per_page
+        return events[start:start + per_page], len(events) > start + per_page
+
+    if _dialect() == 'sqlite':
+        #"heat"* "pool"* -> every word must match, each as a prefix
+        match = ' '.join(f'"{t}"*' for t in tokens)
+        stmt = (
+            db.select(Event)
+            .join(_event_fts, _event_fts.c.rowid == Event.id)
+            .where(literal_column('event_fts').op('MATCH')(match))
+            #bm25 is "lower is better"
+            .order_by(func.bm25(literal_column('event_fts')), Event.date.asc())
+        )
+    else:
+        tsquery = ' & '.join(f'{t}:*' for t in tokens)
+        query = func.to_tsquery('simple', tsquery)
+        stmt = (
+            db.select(Event)
+            .where(literal_column(_PG_TSVECTOR).op('@@')(query))
+            .order_by(func.ts_rank(literal_column(_PG_TSVECTOR), query).desc(), Event.date.asc())
+        )
+
+    #fetch one extra row to know if there's another page
+    stmt = (
+        stmt.options(selectinload(Event.creator))
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+    )
+    events = db.session.scalars(stmt).all()
+    return events[:per_page], len(events) > per_page
+
+
+@click.command('build-search-index')
+@with_appcontext
+def build_search_index_command():
+    if not index_ddl():
+        click.echo(f"No full-text index for {_dialect()}, search will keep using ILIKE.")
+        return
+    build_index()
+    click.echo("Search index built.")
@@ -0,0 +1,96 @@
+#commented
+
+#Scheduled status transitions
+#
+#Event.status is worked out at read time (see models.py), but the stored column
+#still gets used for filtering/reporting and it only changes on bookings,
+#cancellations and edits. Events that simply reach their date (or get sold out
+#some other way) would keep an old "Open" in the db forever.
+#
+#refresh_statuses() fixes all of them at once with ONE set-based UPDATE:
+#   UPDATE event SET status = <derived status> WHERE lower(status) != lower(<derived status>)
+#so nothing is loaded into python no matter how many events there are. (Compared
+#case-insensitively like Event.status itself, a stored "cancelled" is left alone.)
+#
+#`flask check-statuses` checks the SQL version of Event.status agrees with the python
+#one for every event, if they ever disagree refresh_statuses() writes the wrong value.
+#
+#It can be run:
+# - from the CLI:  flask --app main refresh-statuses   (e.g. from cron)
+# - in-process: set STATUS_REFRESH_INTERVAL (seconds) and create_app() starts a
+#   background thread that runs it on that interval
+
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import db, page_cache
+from .models import Event
+
+
+#Persist the derived status for every event whose stored status is stale
+#returns how many rows changed
+def refresh_statuses():
+    start = time.perf_counter()
+    result = db.session.execute(
+        db.update(Event)
+        .where(db.func.lower(Event.stored_status) != db.func.lower(Event.status))
+        .values(stored_status=Event.status)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    if result.rowcount:
+        page_cache.invalidate_events()  #cached listing pages show the old status
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    current_app.logger.info("Status refresh: %s event(s) changed in %.1f ms", result.rowcount, elapsed_ms)
+    return result.rowcount
+
+
+@click.command('refresh-statuses')
+@with_appcontext
+def refresh_statuses_command():
+    changed = refresh_statuses()
+    click.echo(f"Updated status on {changed} event(s).")
+
+
+#Compare Event.status worked out in SQL (what refresh_statuses() writes) with the
+#python property (what the pages show) for every event, exits 1 on any difference
+@click.command('check-statuses')
+@with_appcontext
+def check_statuses_command():
+    stmt = db.select(Event, Event.status.label('sql_status')).execution_options(yield_per=1000)
+    checked = mismatches = 0
+    for event, sql_status in db.session.execute(stmt):
+        checked += 1
+        if event.status != sql_status:
+            mismatches += 1
+            click.echo(f"Event {event.id}: stored {event.stored_status!r}, python says {event.status!r}, "
+                       f"SQL says {sql_status!r}")
+    if mismatches:
+        click.echo(f"{mismatches} of {checked} event(s) disagree.")
+        raise SystemExit(1)
+    click.echo(f"All {checked} event(s) agree.")
+
+
+#Background thread that calls refresh_statuses() every `interval` seconds
+#daemon=True so it never stops the process from exiting
+def start_scheduler(app, interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    refresh_statuses()
+                except Exception:
+                    #never let one bad run kill the thread, just log it and try next time
+                    db.session.rollback()
+                    app.logger.exception("Status refresh failed")
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='status-refresh', daemon=True)
+    thread.start()
+    return thread
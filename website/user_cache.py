@@ -0,0 +1,154 @@
+#commented
+
+#Cached user identity for flask-login
+#
+#flask-login calls load_user() at the start of EVERY request that has a logged in
+#session, and it used to do a SELECT on the user table each time, just so the navbar
+#could say "Welcome back, <name>" and @login_required could pass.
+#
+#Now load_user() returns a small CachedUser (id, name, email), kept in an in-process
+#LRU keyed by user id:
+# - entries expire after USER_CACHE_TTL seconds (default 60), which bounds how stale
+#   another worker's copy can get
+# - any ORM update/delete of a User (session flush) drops that user's entry in this
+#   worker straight away (mapper events below), so profile changes show up at once
+# - USER_CACHE_TTL=0 turns the cache off (always queries, like before)
+#
+#CachedUser is NOT a db object, it only has id/name/email. Anything that needs the
+#real row (e.g. the password hash) should load it with db.session.get(User, current_user.id).
+#
+#Hits/misses are counted globally (stats()) and per request (X-User-Cache header
+#next to X-Query-Count).
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_request_context
+from flask_login import UserMixin
+from sqlalchemy import event
+
+from . import db
+from .models import User
+
+
+#What current_user is for a logged in request
+class CachedUser(UserMixin):
+    def __init__(self, id, name, email):
+        self.id = id
+        self.name = name
+        self.email = email
+
+    def __repr__(self):
+        return f"<CachedUser {self.id} {self.name}>"
+
+
+#LRU with a per-entry expiry time, one per worker process
+class UserCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._data[user_id]
+                return None
+            self._data.move_to_end(user_id)
+            return user
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._data[user_id] = (user, time.monotonic() + self.ttl)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+#global hit/miss counters (per worker)
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+#every cache made by init_app, so the mapper events can reach them
+_caches = []
+
+
+def _count(kind):
+    with _stats_lock:
+        _stats[kind] += 1
+    if has_request_context():
+        g.user_cache = 'hit' if kind == 'hits' else 'miss'
+
+
+def stats():
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / total if total else 0.0}
+
+
+def _cache():
+    return current_app.extensions.get('user_cache')
+
+
+#the flask-login user_loader
+def load_user(user_id):
+    try:
+        uid = int(user_id) #ensures id is integer
+    except (TypeError, ValueError):
+        return None
+
+    cache = _cache()
+    if cache is not None:
+        user = cache.get(uid)
+        if user is not None:
+            _count('hits')
+            return user
+    _count('misses')
+
+    #only the columns the identity needs, not the whole row
+    row = db.session.execute(
+        db.select(User.id, User.name, User.email).where(User.id == uid)
+    ).first()
+    if row is None:
+        return None  #deleted user, nothing cached so it's checked again next time
+    user = CachedUser(row.id, row.name, row.email)
+    if cache is not None:
+        cache.set(uid, user)
+    return user
+
+
+#Drop a user's cached identity, call after changing their name/email
+def invalidate_user(user_id):
+    for cache in _caches:
+        cache.invalidate(user_id)
+
+
+#any ORM update or delete of a user clears them from the cache
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    invalidate_user(target.id)
+
+
+def init_app(app, login_manager):
+    ttl = app.config.get('USER_CACHE_TTL', 60)
+    cache = None
+    if ttl > 0:
+        cache = UserCache(app.config.get('USER_CACHE_SIZE', 1024), ttl)
+        _caches.append(cache)
+    app.extensions['user_cache'] = cache
+    login_manager.user_loader(load_user)
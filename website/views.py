@@ -1,19 +1,24 @@
 #commented
 
-from flask import Blueprint, render_template, session
-from .models import Event # Import the event model, that way pass through to the index
+from flask import Blueprint, render_template
+from flask_login import current_user
+from . import queries # Shared listing queries (eager-loads the event creator)
+from .replicas import replica_reads # GETs can be served from a read replica
+from .page_cache import cached_page # anonymous visitors get a cached copy
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
+@replica_reads
+@cached_page()
 def index():
     #Regardless of the logged in status, pass the events through to the index
-    events = Event.query.order_by(Event.date.asc()).limit(5).all() #This will get the newest five events
+    events = queries.first_events(5) #This will get the newest five events
 
-    # Check if an email is stored in session (set in auth.py after login)
-    if 'email' in session:
+    # Check if someone is logged in (current_user comes from the user cache, no query)
+    if current_user.is_authenticated:
         #Pass the email into the template so it can display a welcome message
-        return render_template('home.html', email=session['email'], name=session['name'], events=events)
+        return render_template('home.html', email=current_user.email, name=current_user.name, events=events)
     else:
         #No one logged in yet
         return render_template('home.html', events=events)
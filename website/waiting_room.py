@@ -0,0 +1,252 @@
+#commented
+
+#Virtual waiting room for big on-sales
+#
+#When a popular event opens everyone hits book_event in the same second and the seat
+#UPDATE on that one event row turns into a thundering herd (lock retries and "busy,
+#please try again" errors). An event can opt in by setting Event.waiting_room_rate
+#(bookings per minute, on the create/edit form, empty = no waiting room). Then:
+# - "Join the queue" (/<id>/queue) gives you a place in line, which is really just
+#   the time you'll be let in (admit_at). Places are handed out waiting_room_rate per
+#   minute, so however many people turn up at once they reach the booking form at a
+#   rate the database can keep up with
+# - places are kept server side in the backend below, one per user + event, so
+#   logging in again (or from another browser) gets you the same place, and waiting
+#   and polling /<id>/queue/status costs no database work at all
+# - once admit_at has passed you get the booking form for WAITING_ROOM_HOLD seconds
+#   (default 5 minutes), after that the place expires and you have to queue again
+# - booking claims the place in the backend (one booking per place, even if the
+#   same user sends two at once), a failed booking gives it back
+# - book_event and the API booking turn away anyone without a live place
+#
+#Backends, same idea as fragment_cache.py / admission.py:
+# - MemoryBackend -> per worker and exact. With several workers each one lets people
+#   in at the full rate (and keeps its own places), so use:
+# - SharedBackend -> any redis-style client (get / set(ex=) / incr / expire) in
+#   WAITING_ROOM_CLIENT, one queue for every worker. Time is cut into slots that
+#   each hold the next few places, and a place is claimed with incr
+
+import json
+import math
+import threading
+import time
+
+from flask import current_app
+from flask_login import current_user
+
+#the memory backend drops expired places after this many joins
+SWEEP_EVERY = 1000
+
+
+#How many seconds each slot covers, and how many places slot k holds
+#at 60/min or less it's one place per slot. Faster than that the slots are a second
+#each and the fractions are carried over (90/min -> 1, 2, 1, 2, ... places), so the
+#rate really is per_minute and not rounded to whole places per second
+def _slots(per_minute):
+    if per_minute <= 60:
+        return 60.0 / per_minute, lambda slot: 1
+    return 1.0, lambda slot: (slot + 1) * per_minute // 60 - slot * per_minute // 60
+
+
+#In-process queues and places, one set per worker
+class MemoryBackend:
+    def __init__(self):
+        #event id -> when the next place is due (epoch seconds)
+        self._tails = {}
+        #(event id, user id) -> {admit_at, rate, expires_at, used}
+        self._places = {}
+        self._joins = 0
+        self._lock = threading.Lock()
+
+    def _live(self, event_id, user_id, now):
+        place = self._places.get((event_id, user_id))
+        return place if place is not None and now <= place['expires_at'] else None
+
+    def place(self, event_id, user_id):
+        with self._lock:
+            place = self._live(event_id, user_id, time.time())
+            return dict(place) if place is not None else None
+
+    #the user's live place, or a new one at the end of the queue
+    def join(self, event_id, user_id, per_minute, hold):
+        now = time.time()
+        with self._lock:
+            place = self._live(event_id, user_id, now)
+            if place is None or place['used']:
+                admit_at = max(now, self._tails.get(event_id, 0.0))
+                self._tails[event_id] = admit_at + 60.0 / per_minute
+                place = {'admit_at': admit_at, 'rate': per_minute, 'expires_at': admit_at + hold, 'used': False}
+                self._places[(event_id, user_id)] = place
+                self._joins += 1
+                if self._joins % SWEEP_EVERY == 0:
+                    self._places = {k: v for k, v in self._places.items() if now <= v['expires_at']}
+            return dict(place)
+
+    #use the place for a booking, False if it isn't their turn / it's gone / already used
+    def claim(self, event_id, user_id):
+        now = time.time()
+        with self._lock:
+            place = self._live(event_id, user_id, now)
+            if place is None or place['used'] or place['admit_at'] > now:
+                return False
+            place['used'] = True
+            return True
+
+    #the booking didn't go through, they can try again with the same place
+    def unclaim(self, event_id, user_id):
+        with self._lock:
+            place = self._places.get((event_id, user_id))
+            if place is not None:
+                place['used'] = False
+
+
+#Slot counters and places in a redis-style store shared by every worker
+#slot k covers [k*width, (k+1)*width) and holds _slots() places. "next" remembers the
+#first slot that might still have room so a long queue isn't walked from the start.
+#A place is a json value under <prefix><event>:user:<user id>, and whether it's been
+#used is a counter next to it (incr, so only one booking can claim it)
+class SharedBackend:
+    def __init__(self, client, prefix='queue:'):
+        self.client = client
+        self.prefix = prefix
+
+    def _place_key(self, event_id, user_id):
+        return f"{self.prefix}{event_id}:user:{user_id}"
+
+    #one counter per place (admit_at is in the name), a new place starts unused
+    def _used_key(self, event_id, user_id, place):
+        return f"{self.prefix}{event_id}:used:{user_id}:{place['admit_at']!r}"
+
+    def _ttl(self, place, now):
+        return max(1, int(place['expires_at'] - now) + 1)
+
+    def place(self, event_id, user_id):
+        raw = self.client.get(self._place_key(event_id, user_id))
+        if raw is None:
+            return None
+        place = json.loads(raw)
+        if time.time() > place['expires_at']:
+            return None
+        place['used'] = int(self.client.get(self._used_key(event_id, user_id, place)) or 0) > 0
+        return place
+
+    def _next_admit_at(self, event_id, per_minute):
+        width, size = _slots(per_minute)
+        now = time.time()
+        hint = f"{self.prefix}{event_id}:next"
+        slot = max(int(now // width), int(self.client.get(hint) or 0))
+        while True:
+            name = f"{self.prefix}{event_id}:{slot}"
+            used = self.client.incr(name)
+            ttl = int((slot + 1) * width - now) + 60
+            if used == 1:
+                self.client.expire(name, ttl)
+            places = size(slot)
+            if used <= places:
+                if used == places:
+                    self.client.set(hint, slot + 1, ex=ttl)
+                return max(now, slot * width + (used - 1) * width / places)
+            slot += 1
+            self.client.set(hint, slot, ex=ttl)
+
+    def join(self, event_id, user_id, per_minute, hold):
+        place = self.place(event_id, user_id)
+        if place is not None and not place['used']:
+            return place
+        admit_at = self._next_admit_at(event_id, per_minute)
+        place = {'admit_at': admit_at, 'rate': per_minute, 'expires_at': admit_at + hold}
+        self.client.set(self._place_key(event_id, user_id), json.dumps(place), ex=self._ttl(place, time.time()))
+        return dict(place, used=False)
+
+    def claim(self, event_id, user_id):
+        place = self.place(event_id, user_id)
+        now = time.time()
+        if place is None or place['admit_at'] > now:
+            return False
+        name = self._used_key(event_id, user_id, place)
+        used = self.client.incr(name)
+        if used == 1:
+            self.client.expire(name, self._ttl(place, now))
+        return used == 1
+
+    def unclaim(self, event_id, user_id):
+        place = self.place(event_id, user_id)
+        if place is not None:
+            self.client.set(self._used_key(event_id, user_id, place), 0, ex=self._ttl(place, time.time()))
+
+
+def _backend():
+    return current_app.extensions['waiting_room']
+
+
+def _hold():
+    return current_app.config.get('WAITING_ROOM_HOLD', 300)
+
+
+def _user_id():
+    return current_user.id if current_user.is_authenticated else None
+
+
+def enabled(event):
+    return bool(event.waiting_room_rate)
+
+
+#this user's unused place for an event ({admit_at, rate, ...}), None if they have
+#no live place (never joined, expired, or already booked with it)
+def place(event_id):
+    user_id = _user_id()
+    if user_id is None:
+        return None
+    entry = _backend().place(event_id, user_id)
+    return entry if entry is not None and not entry['used'] else None
+
+
+#Get a place in the queue (or keep the one we already have), returns admit_at
+def join(event):
+    return _backend().join(event.id, _user_id(), event.waiting_room_rate, _hold())['admit_at']
+
+
+#True if this user may book the event right now
+def admitted(event):
+    if not enabled(event):
+        return True
+    entry = place(event.id)
+    return entry is not None and entry['admit_at'] <= time.time()
+
+
+#Use the place up for a booking. False if they may not book (not their turn, no
+#place, or it was just used by another request), then don't book
+def claim(event):
+    if not enabled(event):
+        return True
+    user_id = _user_id()
+    return user_id is not None and _backend().claim(event.id, user_id)
+
+
+#The booking after claim() failed (sold out etc), hand the place back
+def unclaim(event):
+    if enabled(event) and _user_id() is not None:
+        _backend().unclaim(event.id, _user_id())
+
+
+#Where this user stands, for the waiting page / status endpoint / view_event
+#None if they aren't queued (or their place expired)
+def status(event_id):
+    entry = place(event_id)
+    if entry is None:
+        return None
+    now = time.time()
+    wait = max(0.0, entry['admit_at'] - now)
+    return {
+        'admitted': wait == 0,
+        #people let in before you that haven't been yet
+        'ahead': int(math.ceil(wait * entry['rate'] / 60.0)),
+        'wait_seconds': int(math.ceil(wait)),
+        #how long the booking form stays open (from now) once you're in
+        'hold_seconds': int(entry['expires_at'] - now),
+    }
+
+
+def init_app(app):
+    client = app.config.get('WAITING_ROOM_CLIENT')
+    app.extensions['waiting_room'] = SharedBackend(client) if client is not None else MemoryBackend()